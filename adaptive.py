@@ -0,0 +1,220 @@
+"""
+Adaptive benchmark driver with data dependent warmup and stopping rules.
+
+Instead of a fixed number of warmup and measurement runs, the queries are executed in batches (one pass over the
+queries that still need measurements per batch):
+
+- warmup ends once the total latency of consecutive batches changes by less than `warmup_tolerance`
+- a query stops being measured once the confidence interval of its mean latency is narrower than `ci_target`
+  (relative half-width), so the remaining budget goes to the queries with the most uncertainty
+- queries that time out `quarantine_after` times are excluded from further batches
+"""
+import csv
+import json
+import logging
+import math
+import statistics
+import time
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+
+import requests
+
+import tracing
+
+
+@dataclass
+class AdaptiveConfig:
+    timeout_seconds: float = 180
+    min_warmup_batches: int = 1
+    max_warmup_batches: int = 10
+    warmup_tolerance: float = 0.05  # relative change of the batch latency that counts as stable
+    min_runs: int = 3
+    max_runs: int = 30
+    ci_target: float = 0.05  # relative half-width of the confidence interval of the mean
+    confidence: float = 0.95
+    quarantine_after: int = 2  # timeouts until a query is excluded
+    budget_seconds: float | None = None  # stop measuring when the whole cell took this long
+
+
+@dataclass
+class QueryStatistics:
+    query_id: int
+    latencies_s: list[float] = field(default_factory=list)
+    timeouts: int = 0
+    failures: int = 0
+    statuses: dict[int, int] = field(default_factory=dict)
+    converged: bool = False
+    quarantined: bool = False
+
+    @property
+    def mean_s(self) -> float | None:
+        return statistics.fmean(self.latencies_s) if self.latencies_s else None
+
+    def ci_half_width_s(self, confidence: float) -> float | None:
+        n = len(self.latencies_s)
+        if n < 2:
+            return None
+        return t_quantile(n - 1, confidence) * statistics.stdev(self.latencies_s) / math.sqrt(n)
+
+    def relative_ci(self, confidence: float) -> float:
+        half_width = self.ci_half_width_s(confidence)
+        if half_width is None or not self.mean_s:
+            return math.inf
+        return half_width / self.mean_s
+
+
+# two-sided Student t quantiles for 1 to 29 degrees of freedom, the expansion below is too inaccurate there
+T_TABLE = {
+    0.90: [6.314, 2.920, 2.353, 2.132, 2.015, 1.943, 1.895, 1.860, 1.833, 1.812, 1.796, 1.782, 1.771, 1.761, 1.753,
+           1.746, 1.740, 1.734, 1.729, 1.725, 1.721, 1.717, 1.714, 1.711, 1.708, 1.706, 1.703, 1.701, 1.699],
+    0.95: [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228, 2.201, 2.179, 2.160, 2.145, 2.131,
+           2.120, 2.110, 2.101, 2.093, 2.086, 2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045],
+    0.99: [63.657, 9.925, 5.841, 4.604, 4.032, 3.707, 3.499, 3.355, 3.250, 3.169, 3.106, 3.055, 3.012, 2.977, 2.947,
+           2.921, 2.898, 2.878, 2.861, 2.845, 2.831, 2.819, 2.807, 2.797, 2.787, 2.779, 2.771, 2.763, 2.756],
+}
+
+
+def t_quantile(df: int, confidence: float) -> float:
+    """
+    Two-sided Student t quantile, from `T_TABLE` for small degrees of freedom and otherwise a Cornish-Fisher expansion
+    around the normal quantile.
+    """
+    table = T_TABLE.get(round(confidence, 4))
+    if table is not None and df <= len(table):
+        return table[df - 1]
+    if df < 30:
+        logging.warning(f"No exact t quantile for confidence {confidence} and {df} degrees of freedom, "
+                        f"the confidence interval is approximated.")
+    z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+    return (z
+            + (z ** 3 + z) / (4 * df)
+            + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * df ** 2)
+            + (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / (384 * df ** 3))
+
+
+class AdaptiveRunner:
+    def __init__(self, endpoint: str, config: AdaptiveConfig = AdaptiveConfig()) -> None:
+        self.endpoint = endpoint
+        self.config = config
+        self.session = requests.Session()
+
+    def execute(self, query: str, stats: QueryStatistics, record: bool) -> float:
+        """Run a query once and return its latency, the full response is read like iguana does."""
+        start = time.perf_counter()
+        try:
+            response = self.session.get(self.endpoint, params={"query": query}, timeout=self.config.timeout_seconds,
+                                        headers={"Accept": "application/sparql-results+json"})
+            _ = response.content
+            latency = time.perf_counter() - start
+        except requests.Timeout:
+            stats.timeouts += 1
+            if record:
+                # leaving timeouts out would bias the mean low, the timeout is a lower bound of the latency
+                stats.latencies_s.append(self.config.timeout_seconds)
+            if stats.timeouts >= self.config.quarantine_after and not stats.quarantined:
+                stats.quarantined = True
+                logging.info(f"Quarantined query {stats.query_id} after {stats.timeouts} timeouts.")
+            return self.config.timeout_seconds
+        except requests.RequestException:
+            stats.failures += 1
+            return time.perf_counter() - start
+        stats.statuses[response.status_code] = stats.statuses.get(response.status_code, 0) + 1
+        if response.status_code != 200:
+            stats.failures += 1
+        elif record:
+            stats.latencies_s.append(latency)
+        return latency
+
+    def _batch(self, queries: list[str], selected: list[QueryStatistics], record: bool) -> float:
+        total = 0.0
+        for stats in selected:
+            if stats.quarantined:
+                continue
+            total += self.execute(queries[stats.query_id], stats, record)
+        return total
+
+    def _pending(self, all_stats: list[QueryStatistics]) -> list[QueryStatistics]:
+        """Queries that still need measurements, the most uncertain first."""
+        pending = []
+        for stats in all_stats:
+            if stats.quarantined or stats.converged:
+                continue
+            runs = len(stats.latencies_s)
+            # queries that only fail never produce latencies, limit them by their attempts
+            if runs >= self.config.max_runs or runs + stats.failures >= self.config.max_runs:
+                continue
+            if runs >= self.config.min_runs and stats.relative_ci(self.config.confidence) <= self.config.ci_target:
+                stats.converged = True
+                continue
+            pending.append(stats)
+        return sorted(pending, key=lambda s: -s.relative_ci(self.config.confidence))
+
+    def run(self, queries_path: Path, results_dir: Path) -> list[QueryStatistics]:
+        with open(queries_path) as f:
+            queries = [line.strip() for line in f if line.strip()]
+        all_stats = [QueryStatistics(i) for i in range(len(queries))]
+        start = time.perf_counter()
+
+        with tracing.span("warmup", mode="adaptive", queries=len(queries)) as span:
+            previous = None
+            batches = 0
+            for batches in range(1, self.config.max_warmup_batches + 1):
+                total = self._batch(queries, all_stats, record=False)
+                stable = previous is not None and abs(total - previous) <= self.config.warmup_tolerance * previous
+                logging.info(f"Warmup batch {batches}: {total:.3f}s.")
+                if stable and batches >= self.config.min_warmup_batches:
+                    break
+                previous = total
+            span.set(batches=batches)
+
+        with tracing.span("measure", mode="adaptive", queries=len(queries)) as span:
+            batches = 0
+            while pending := self._pending(all_stats):
+                if self.config.budget_seconds is not None and time.perf_counter() - start > self.config.budget_seconds:
+                    logging.info(f"Benchmark budget of {self.config.budget_seconds}s exhausted, "
+                                 f"{len(pending)} queries did not converge.")
+                    break
+                batches += 1
+                self._batch(queries, pending, record=True)
+                logging.debug(f"Measurement batch {batches}: {len(pending)} queries.")
+            span.set(batches=batches, converged=sum(s.converged for s in all_stats),
+                     quarantined=sum(s.quarantined for s in all_stats))
+
+        self.write_results(all_stats, results_dir, time.perf_counter() - start)
+        return all_stats
+
+    def write_results(self, all_stats: list[QueryStatistics], results_dir: Path, elapsed_s: float) -> None:
+        results_dir.mkdir(parents=True, exist_ok=True)
+        confidence = self.config.confidence
+        summary = {
+            "config": asdict(self.config),
+            "elapsed_s": elapsed_s,
+            "queries": len(all_stats),
+            "converged": sum(s.converged for s in all_stats),
+            "quarantined": [s.query_id for s in all_stats if s.quarantined],
+            "runs": sum(len(s.latencies_s) for s in all_stats),
+            "per_query": [{
+                "query_id": s.query_id,
+                "runs": len(s.latencies_s),
+                "mean_s": s.mean_s,
+                "median_s": statistics.median(s.latencies_s) if s.latencies_s else None,
+                "ci_half_width_s": s.ci_half_width_s(confidence),
+                "converged": s.converged,
+                "quarantined": s.quarantined,
+                "timeouts": s.timeouts,
+                "failures": s.failures,
+                "statuses": s.statuses,
+            } for s in all_stats],
+        }
+        results_dir.joinpath("adaptive.json").write_text(json.dumps(summary, indent=2))
+        with open(results_dir.joinpath("latencies.csv"), "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["query_id", "run", "latency_s"])
+            for s in all_stats:
+                writer.writerows((s.query_id, run, latency) for run, latency in enumerate(s.latencies_s))
+        logging.info(f"Adaptive benchmark finished after {elapsed_s:.0f}s: {summary['converged']}/{len(all_stats)} "
+                     f"queries converged, {len(summary['quarantined'])} quarantined, {summary['runs']} runs.")
+
+    def close(self) -> None:
+        self.session.close()
@@ -1,18 +1,39 @@
-# TODO: monitor loading
-
+import atexit
 import logging
 from datetime import datetime
 from pathlib import Path
 from rich.logging import RichHandler
 
+import tracing
 import util
+from adaptive import AdaptiveConfig, AdaptiveRunner
+from bgp import ClientSideBGPEngine
 from iguana import Iguana
+from load_monitor import LoadFailedError
+from loadgen import LoadCoordinator
+from proxy import RecordingProxy
+from scaling import scaling_sweep as run_scaling_sweep
 from dataset import SWDF, Wikidata, Dataset, Watdiv, DBpedia2015
 from triplestore import Tentris, Fuseki, ITR, Triplestore, Oxigraph, Virtuoso
 
 if __name__ == "__main__":
     dry_run = False
     debug_logging = False
+    # additionally evaluate the complete BGPs of the original queries client-side, see bgp.py
+    client_side_bgp = False
+    # rerun load and benchmark per core count and memory cap instead of a single run, see scaling.py
+    scaling_sweep = False
+    # route iguana's requests through a local proxy recording time to first byte and transfer time, see proxy.py
+    record_proxy = False
+    # replace the fixed iguana warmup and query runs by batches that stop once latencies are stable, see adaptive.py
+    adaptive = False
+    # additionally generate load with several client processes after the benchmark, see loadgen.py
+    distributed_load = False
+    load_agents = 4
+    load_threads_per_agent = 4
+    load_duration_s = 60
+    sweep_cores = [1, 2, 4, 8, 16]
+    sweep_memory_limits_g = [None]  # None uses ram_limit_g
 
     # setup logging
     Path("logs").mkdir(parents=True, exist_ok=True)
@@ -20,22 +41,35 @@ if __name__ == "__main__":
     console = RichHandler(log_time_format="[%d/%m/%Y %X:%f]", omit_repeated_times=False)
     logging.getLogger('').addHandler(console) 
 
+    run_name = f'benchmark_{datetime.now().isoformat().replace(":", "-")}'
+
     # from getpass import getpass
     # pw = getpass(f"Please enter password for user '{os.getlogin()}': ")
 
     # variables setup
     base_dir = Path("benchmarks")
+    # export the phase trace when the run ends, also if it fails; open it in https://ui.perfetto.dev
+    atexit.register(lambda: logging.info(
+        f"Stored trace in {tracing.tracer.export(base_dir.joinpath('logs').joinpath('traces'), run_name)}."))
     datasets_dir = base_dir.joinpath("datasets")
     # might be best to start only with swdf first, as it is the smallest dataset
     datasets: list[Dataset] = [SWDF(datasets_dir),
                                DBpedia2015(datasets_dir),
                                Wikidata(datasets_dir),
                                Watdiv(datasets_dir)]  # select datasets here
+    # nested samples of every selected dataset, e.g. [0.01, 0.1, 0.5], for scaling curves over the data size
+    scale_fractions: list[float] = []
+    if scale_fractions:
+        datasets += [subset for dataset in list(datasets) for subset in dataset.scaled(scale_fractions)]
     triplestores: list[Triplestore] = [#Tentris(base_dir),
                                        #Fuseki(base_dir),
                                        #Oxigraph(base_dir),
                                        #Virtuoso(base_dir),
                                        ITR(base_dir)]  # select triplestores here
+    # derive loader and server settings from the dataset statistics and the machine, see Triplestore.tune
+    auto_tune = False
+    for triplestore in triplestores:
+        triplestore.auto_tune = auto_tune
 
     # install iguana
     iguana = Iguana(base_dir)
@@ -59,7 +93,9 @@ if __name__ == "__main__":
     for dataset in datasets:
         if not dataset.is_downloaded():
             logging.info(f"Missing {dataset.name} dataset. Downloading it now.")
-            if not dry_run: dataset.download()
+            if not dry_run:
+                with tracing.span("download", dataset=dataset.name):
+                    dataset.download()
         else:
             logging.info(f"Found {dataset.name}.")
 
@@ -87,5 +123,58 @@ if __name__ == "__main__":
                     "result_directory": base_dir.joinpath("results").joinpath(f"{triplestore.name}-{dataset.name}"),
             }
 
-            iguana_configuration = iguana.instantiate_template(f"{triplestore.name}-{dataset.name}", base_dir.joinpath("suites"), **substitution_map)
-            iguana.run_benchmark(triplestore, dataset, iguana_configuration)
+            if not scaling_sweep and not dry_run:
+                # skip this cell if the loader fails or would take longer than max_load_seconds, see load_monitor.py
+                try:
+                    triplestore.ensure_loaded(dataset)
+                except LoadFailedError as e:
+                    logging.error(f"Skipping the benchmark of {dataset.name} on {triplestore.name}: {e}")
+                    continue
+
+            if scaling_sweep:
+                run_scaling_sweep(triplestore, dataset, iguana, substitution_map, base_dir.joinpath("suites"),
+                                  base_dir.joinpath("results").joinpath("scaling"), sweep_cores, sweep_memory_limits_g)
+                continue
+
+            proxy = None
+            if record_proxy:
+                proxy = RecordingProxy(triplestore.sparql_endpoint,
+                                       base_dir.joinpath("logs").joinpath("proxy").joinpath(f"{triplestore.name}-{dataset.name}-{run_name}.bin")).start()
+                substitution_map["triplestore_endpoint"] = proxy.endpoint
+
+            try:
+                if adaptive:
+                    runner = AdaptiveRunner(substitution_map["triplestore_endpoint"],
+                                            AdaptiveConfig(timeout_seconds=substitution_map["timeout_seconds"],
+                                                           max_warmup_batches=substitution_map["warmup_query_runs"],
+                                                           max_runs=substitution_map["query_runs"]))
+                    with tracing.span("benchmark", dataset=dataset.name, triplestore=triplestore.name, mode="adaptive"):
+                        with triplestore.running(triplestore.ensure_loaded(dataset)):
+                            runner.run(dataset.queries_path, substitution_map["result_directory"])
+                    runner.close()
+                else:
+                    iguana_configuration = iguana.instantiate_template(f"{triplestore.name}-{dataset.name}", base_dir.joinpath("suites"), **substitution_map)
+                    with tracing.span("benchmark", dataset=dataset.name, triplestore=triplestore.name):
+                        iguana.run_benchmark(triplestore, dataset, iguana_configuration)
+            finally:
+                if proxy is not None:
+                    proxy.stop()
+
+            if distributed_load:
+                logging.info(f"Generating load on {triplestore.name} with {load_agents} agents.")
+                coordinator = LoadCoordinator(triplestore.sparql_endpoint, dataset.queries_path, agents=load_agents,
+                                              threads=load_threads_per_agent, duration_s=load_duration_s,
+                                              timeout_seconds=substitution_map["timeout_seconds"])
+                with tracing.span("benchmark", dataset=dataset.name, triplestore=triplestore.name, mode="distributed"):
+                    with triplestore.running(triplestore.ensure_loaded(dataset)):
+                        coordinator.run(base_dir.joinpath("results").joinpath(f"{triplestore.name}-{dataset.name}-load"))
+
+            if client_side_bgp:
+                logging.info(f"Evaluating the BGPs of {dataset.name} client-side on {triplestore.name}.")
+                engine = ClientSideBGPEngine(triplestore.sparql_endpoint, timeout_seconds=substitution_map["timeout_seconds"])
+                with tracing.span("benchmark", dataset=dataset.name, triplestore=triplestore.name, mode="client-side-bgp"):
+                    with triplestore.running(triplestore.ensure_loaded(dataset)):
+                        engine.run(dataset.original_queries_path,
+                                   base_dir.joinpath("results").joinpath(f"{triplestore.name}-{dataset.name}-bgp").joinpath("bgp.csv"),
+                                   runs=1)
+                engine.close()
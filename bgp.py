@@ -0,0 +1,349 @@
+"""
+Client-side evaluation of basic graph patterns (BGPs) over endpoints that only answer single triple patterns.
+
+`translate_to_simple_triple` reduces every benchmark query to its first triple pattern. This module evaluates
+the complete BGP instead: the patterns are ordered by estimated selectivity, the first one is fetched from the
+endpoint, and every following pattern is evaluated either as a bind join (one single-pattern request per distinct
+binding of the join variables, issued concurrently in batches) or, if there are too many bindings, by fetching the
+pattern once. Partial results are combined locally with hash joins.
+"""
+import csv
+import json
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+
+import requests
+
+import tracing
+
+# IRIs, literals with optional language tag or datatype, variables, blank nodes, prefixed names and separators
+TOKEN = re.compile(r'<[^>]*>'
+                   r'|"(?:[^"\\]|\\.)*"(?:@[A-Za-z0-9-]+|\^\^<[^>]*>)?'
+                   r'|[?$][A-Za-z0-9_]+'
+                   r'|_:[A-Za-z0-9_.-]+'
+                   r'|[.;,]'
+                   r'|[^\s.;,]+(?:\.[^\s.;,]+)*')
+
+
+class UnsupportedQueryError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class TriplePattern:
+    subject: str
+    predicate: str
+    object: str
+
+    @property
+    def terms(self) -> tuple[str, str, str]:
+        return self.subject, self.predicate, self.object
+
+    @property
+    def variables(self) -> set[str]:
+        return {term for term in self.terms if is_variable(term)}
+
+    def bind(self, solution: dict[str, str]) -> "TriplePattern":
+        return TriplePattern(*(solution.get(term, term) if is_variable(term) else term for term in self.terms))
+
+    def to_query(self) -> tuple[str, dict[str, str]]:
+        """
+        Translate the pattern into a single-pattern query using the variable names ?s ?p ?o, like
+        `translate_to_simple_triple` does.
+        :return: The query and a mapping from the query variables back to the variables of the pattern
+        """
+        renamed = []
+        mapping = {}
+        for position, term in zip(("s", "p", "o"), self.terms):
+            if is_variable(term):
+                renamed.append(f"?{position}")
+                mapping[position] = term
+            else:
+                renamed.append(term)
+        variables = " ".join(f"?{v}" for v in mapping) or "*"
+        return f"SELECT {variables} WHERE {{ {renamed[0]} {renamed[1]} {renamed[2]} . }}", mapping
+
+
+def is_variable(term: str) -> bool:
+    return term[0] in "?$"
+
+
+def parse_bgp(query: str) -> tuple[list[str], list[TriplePattern]]:
+    """
+    Parse a `SELECT ... WHERE { ... }` query consisting of a single BGP.
+    :return: The projected variables (empty for `SELECT *`) and the triple patterns
+    """
+    match = re.search(r'SELECT\s+(?:DISTINCT\s+|REDUCED\s+)?(.*?)\s*(?:WHERE\s*)?\{(.*)\}', query,
+                      re.DOTALL | re.IGNORECASE)
+    if not match:
+        raise UnsupportedQueryError("not a SELECT query")
+    projection = [v for v in match.group(1).split() if is_variable(v)]
+    body = match.group(2)
+    if "{" in body or re.search(r'\b(FILTER|OPTIONAL|UNION|MINUS|BIND|VALUES|GRAPH|SERVICE)\b', body, re.IGNORECASE):
+        raise UnsupportedQueryError("query is not a plain BGP")
+
+    patterns = []
+    current: list[str] = []
+    for token in TOKEN.findall(body):
+        if token == ".":
+            if current and len(current) != 3:
+                raise UnsupportedQueryError(f"incomplete triple pattern {current}")
+            current = []
+            continue
+        if token == ";":  # same subject
+            if len(current) != 3:
+                raise UnsupportedQueryError(f"incomplete triple pattern {current}")
+            current = current[:1]
+            continue
+        if token == ",":  # same subject and predicate
+            if len(current) != 3:
+                raise UnsupportedQueryError(f"incomplete triple pattern {current}")
+            current = current[:2]
+            continue
+        current.append("<http://www.w3.org/1999/02/22-rdf-syntax-ns#type>" if token == "a" else token)
+        if len(current) == 3:
+            patterns.append(TriplePattern(*current))
+    if len(current) not in (0, 3):
+        raise UnsupportedQueryError(f"incomplete triple pattern {current}")
+    if not patterns:
+        raise UnsupportedQueryError("query contains no triple pattern")
+    return projection, patterns
+
+
+@dataclass
+class SolutionModifiers:
+    distinct: bool = False  # DISTINCT, REDUCED is treated the same, which it allows
+    limit: int | None = None
+    offset: int = 0
+
+    def apply(self, solutions: list[dict]) -> list[dict]:
+        if self.distinct:
+            solutions = list({tuple(sorted(s.items())): s for s in solutions}.values())
+        end = None if self.limit is None else self.offset + self.limit
+        return solutions[self.offset:end]
+
+
+def parse_modifiers(query: str) -> SolutionModifiers:
+    """
+    Parse the solution modifiers of a query `parse_bgp` accepts. Only DISTINCT, REDUCED, LIMIT and OFFSET can be
+    applied to the joined solutions, anything else changes the results and is unsupported.
+    """
+    match = re.search(r'SELECT\s+(DISTINCT\s+|REDUCED\s+)?(.*?)\s*(?:WHERE\s*)?\{', query, re.DOTALL | re.IGNORECASE)
+    if not match:
+        raise UnsupportedQueryError("not a SELECT query")
+    if "(" in match.group(2):
+        raise UnsupportedQueryError("projection contains expressions")
+    modifiers = SolutionModifiers(distinct=match.group(1) is not None)
+    trailing = query[query.rindex("}") + 1:]
+    for clause in re.finditer(r'\s*(?:(LIMIT|OFFSET)\s+(\d+)|(\S+))', trailing, re.IGNORECASE):
+        if clause.group(3) is not None:
+            raise UnsupportedQueryError(f"unsupported solution modifier {clause.group(3)}")
+        if clause.group(1).upper() == "LIMIT":
+            modifiers.limit = int(clause.group(2))
+        else:
+            modifiers.offset = int(clause.group(2))
+    return modifiers
+
+
+def estimate_cost(pattern: TriplePattern, bound: set[str]) -> int:
+    """
+    Heuristic selectivity estimate, lower is more selective. A bound subject is the most selective position, then
+    the object, while a bound predicate alone selects a large part of most datasets. Variables that are bound by
+    previously evaluated patterns count as bound.
+    """
+    weights = (4, 1, 2)  # subject, predicate, object
+    cost = 8
+    for weight, term in zip(weights, pattern.terms):
+        if not is_variable(term) or term in bound:
+            cost -= weight
+    return cost
+
+
+def order_patterns(patterns: list[TriplePattern]) -> list[TriplePattern]:
+    """Greedily order the patterns by estimated selectivity, preferring patterns connected to bound variables."""
+    remaining = list(patterns)
+    ordered = []
+    bound: set[str] = set()
+    while remaining:
+        connected = [p for p in remaining if not bound or p.variables & bound or not p.variables]
+        candidates = connected or remaining  # cartesian product only if it can't be avoided
+        best = min(candidates, key=lambda p: (estimate_cost(p, bound), len(p.variables)))
+        remaining.remove(best)
+        ordered.append(best)
+        bound |= best.variables
+    return ordered
+
+
+def _term(binding: dict) -> str:
+    """Convert a SPARQL JSON result term back into N-Triples syntax."""
+    value = binding["value"]
+    if binding["type"] == "uri":
+        return f"<{value}>"
+    if binding["type"] == "bnode":
+        return f"_:{value}"
+    escaped = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n").replace("\r", "\\r")
+    if "xml:lang" in binding:
+        return f'"{escaped}"@{binding["xml:lang"]}'
+    if "datatype" in binding:
+        return f'"{escaped}"^^<{binding["datatype"]}>'
+    return f'"{escaped}"'
+
+
+def hash_join(left: list[dict], right: list[dict]) -> list[dict]:
+    if not left or not right:
+        return []
+    shared = sorted(set(left[0]) & set(right[0]))
+    build, probe = (left, right) if len(left) <= len(right) else (right, left)
+    table: dict[tuple, list[dict]] = {}
+    for solution in build:
+        table.setdefault(tuple(solution[v] for v in shared), []).append(solution)
+    joined = []
+    for solution in probe:
+        for match in table.get(tuple(solution[v] for v in shared), ()):
+            joined.append({**match, **solution})
+    return joined
+
+
+@dataclass
+class BGPResult:
+    query_id: int
+    patterns: int
+    results: int = 0
+    requests: int = 0
+    latency_s: float = 0.0
+    error: str = ""
+    # requests issued per pattern, in evaluation order
+    requests_per_pattern: list[int] = field(default_factory=list)
+
+
+class ClientSideBGPEngine:
+    """
+    :param endpoint:            SPARQL endpoint that answers single triple pattern queries
+    :param concurrency:         Number of concurrent requests for bind joins
+    :param batch_size:          Number of bindings that are sent to the endpoint in one batch of concurrent requests
+    :param bind_join_limit:     Above this number of distinct bindings, the pattern is fetched once instead
+    :param timeout_seconds:     Timeout for a complete BGP
+    """
+
+    def __init__(self, endpoint: str, concurrency: int = 8, batch_size: int = 64, bind_join_limit: int = 10_000,
+                 timeout_seconds: float = 180) -> None:
+        self.endpoint = endpoint
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.bind_join_limit = bind_join_limit
+        self.timeout_seconds = timeout_seconds
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bgp")
+
+    def close(self) -> None:
+        self._executor.shutdown()
+
+    def _session(self) -> requests.Session:
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def fetch(self, pattern: TriplePattern, deadline: float) -> list[dict]:
+        """Evaluate a single triple pattern on the endpoint."""
+        query, mapping = pattern.to_query()
+        timeout = deadline - time.perf_counter()
+        if timeout <= 0:
+            raise TimeoutError("BGP evaluation timed out")
+        response = self._session().get(self.endpoint, params={"query": query}, timeout=timeout,
+                                       headers={"Accept": "application/sparql-results+json"})
+        response.raise_for_status()
+        solutions = []
+        for row in response.json()["results"]["bindings"]:
+            solution = {}
+            for query_variable, pattern_variable in mapping.items():
+                term = _term(row[query_variable])
+                # the same variable at two positions of the pattern must bind the same term
+                if solution.setdefault(pattern_variable, term) != term:
+                    break
+            else:
+                solutions.append(solution)
+        return solutions
+
+    def _bind_join(self, solutions: list[dict], pattern: TriplePattern, deadline: float) -> tuple[list[dict], int]:
+        join_variables = sorted(pattern.variables & set(solutions[0]))
+        bindings = list({tuple(s[v] for v in join_variables): None for s in solutions})
+        if len(bindings) > self.bind_join_limit:
+            return hash_join(solutions, self.fetch(pattern, deadline)), 1
+
+        fetched: list[dict] = []
+        for start in range(0, len(bindings), self.batch_size):
+            batch = bindings[start:start + self.batch_size]
+            futures = []
+            for values in batch:
+                binding = dict(zip(join_variables, values))
+                futures.append((binding, self._executor.submit(self.fetch, pattern.bind(binding), deadline)))
+            for binding, future in futures:
+                fetched.extend({**binding, **solution} for solution in future.result())
+        return hash_join(solutions, fetched), len(bindings)
+
+    def evaluate(self, query: str, query_id: int = 0) -> BGPResult:
+        try:
+            projection, patterns = parse_bgp(query)
+            modifiers = parse_modifiers(query)
+        except UnsupportedQueryError as e:
+            return BGPResult(query_id, 0, error=f"unsupported: {e}")
+
+        result = BGPResult(query_id, len(patterns))
+        start = time.perf_counter()
+        deadline = start + self.timeout_seconds
+        try:
+            solutions: list[dict] | None = None
+            for pattern in order_patterns(patterns):
+                if solutions is None:
+                    solutions, requests_issued = self.fetch(pattern, deadline), 1
+                elif not pattern.variables & set(solutions[0]):
+                    solutions, requests_issued = hash_join(solutions, self.fetch(pattern, deadline)), 1
+                else:
+                    solutions, requests_issued = self._bind_join(solutions, pattern, deadline)
+                result.requests += requests_issued
+                result.requests_per_pattern.append(requests_issued)
+                if not solutions:
+                    break
+            if projection and solutions:
+                solutions = [{v: s.get(v) for v in projection} for s in solutions]
+            result.results = len(modifiers.apply(solutions))
+        except (requests.RequestException, TimeoutError, ValueError, KeyError) as e:
+            result.error = repr(e)
+        result.latency_s = time.perf_counter() - start
+        return result
+
+    def run(self, queries_path: Path, results_path: Path, runs: int = 1) -> list[BGPResult]:
+        """
+        Evaluate every SELECT query of the file `runs` times and write the per query latencies and request counts
+        to a CSV file.
+        """
+        with open(queries_path) as f:
+            queries = [line.strip() for line in f if line.strip().startswith("SELECT")]
+
+        results = []
+        with tracing.span("measure", mode="client-side-bgp", queries=len(queries), runs=runs) as span:
+            for run in range(runs):
+                for query_id, query in enumerate(queries):
+                    result = self.evaluate(query, query_id)
+                    results.append(result)
+                    if result.error:
+                        logging.debug(f"BGP query {query_id} failed: {result.error}")
+            span.set(requests=sum(r.requests for r in results), errors=sum(1 for r in results if r.error))
+
+        results_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(results_path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(BGPResult.__dataclass_fields__))
+            writer.writeheader()
+            for result in results:
+                writer.writerow({**asdict(result), "requests_per_pattern": json.dumps(result.requests_per_pattern)})
+        succeeded = [r for r in results if not r.error]
+        if succeeded:
+            logging.info(f"Client-side BGP evaluation: {len(succeeded)}/{len(results)} succeeded, "
+                         f"mean latency {sum(r.latency_s for r in succeeded) / len(succeeded):.3f}s, "
+                         f"mean requests {sum(r.requests for r in succeeded) / len(succeeded):.1f}.")
+        return results
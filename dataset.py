@@ -1,8 +1,10 @@
 from pathlib import Path
+import json
 import zipfile
 
+import tracing
 from query_translate import process_sparql_file
-from util import bash, hash_file, download_file
+from util import bash, hash_file, download_file, HyperLogLog
 
 
 class Dataset:
@@ -12,6 +14,9 @@ class Dataset:
         self.path.mkdir(parents=True, exist_ok=True)
         self.dataset_path: Path = self.path.joinpath("dataset.nt")
         self.queries_path: Path = self.path.joinpath("queries.txt")
+        # the queries before they were reduced to single triple patterns by `process_sparql_file`
+        self.original_queries_path: Path = self.path.joinpath("queries.txt2")
+        self.statistics_path: Path = self.path.joinpath("statistics.json")
 
     def download(self) -> None:
         pass
@@ -19,6 +24,68 @@ class Dataset:
     def is_downloaded(self) -> bool:
         return self.dataset_path.exists() and self.queries_path.exists()
 
+    def statistics(self) -> dict:
+        """
+        Statistics of the dataset file, computed once and cached in `statistics.json`. The cache is invalidated if
+        the dataset file changes.
+        """
+        stat = self.dataset_path.stat()
+        key = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        if self.statistics_path.exists():
+            cached = json.loads(self.statistics_path.read_text())
+            if cached.get("file") == key:
+                return cached
+
+        # N-Triples contain one triple per line
+        triples = 0
+        with open(self.dataset_path, "rb", buffering=0) as f:
+            while chunk := f.read(1 << 24):
+                triples += chunk.count(b"\n")
+        statistics = {"file": key, "triples": triples}
+        self.statistics_path.write_text(json.dumps(statistics, indent=2))
+        return statistics
+
+    def triple_count(self) -> int:
+        return self.statistics()["triples"]
+
+    def distinct_terms(self, max_triples: int = 100_000_000) -> int:
+        """
+        Estimated number of distinct RDF terms, cached in `statistics.json`. Only the first `max_triples` triples
+        are read, for larger datasets the count is extrapolated linearly, which overestimates it.
+        """
+        statistics = self.statistics()
+        if "distinct_terms" not in statistics:
+            sketch = HyperLogLog()
+            read = 0
+            with open(self.dataset_path, "rb") as f:
+                for line in f:
+                    if read >= max_triples:
+                        break
+                    parts = line.split(maxsplit=2)
+                    if len(parts) < 3:
+                        continue
+                    sketch.add(parts[0])
+                    sketch.add(parts[1])
+                    sketch.add(parts[2].rstrip().removesuffix(b".").rstrip())
+                    read += 1
+            estimate = sketch.estimate()
+            if read and read < statistics["triples"]:
+                estimate = round(estimate * statistics["triples"] / read)
+            statistics["distinct_terms"] = estimate
+            statistics["distinct_terms_sampled_triples"] = read
+            self.statistics_path.write_text(json.dumps(statistics, indent=2))
+        return statistics["distinct_terms"]
+
+    def scaled(self, fractions: list[float], seed: int = 0) -> list["SubsetDataset"]:
+        """
+        Nested, deterministic samples of this dataset, e.g. `Watdiv(datasets_dir).scaled([0.01, 0.1, 0.5])`. Each
+        sample is a dataset of its own, named like `watdiv-10pct`.
+        """
+        subsets = [SubsetDataset(self, fraction, seed) for fraction in sorted(set(fractions))]
+        for subset in subsets:
+            subset.siblings = subsets
+        return subsets
+
 
 class SWDF(Dataset):
     def __init__(self, directory: Path):
@@ -32,7 +99,7 @@ class SWDF(Dataset):
         queriesurl_sha1 = 'e8c4d295d29f36f11b0b77a1ea83e13ff7333488'
         assert queriesurl_sha1 == hash_file(self.queries_path, "sha1")
 
-        old = self.queries_path.rename(f'{self.queries_path.absolute()}2')
+        old = self.queries_path.rename(self.original_queries_path)
         process_sparql_file(old, self.queries_path)
 
         # use bash to download and decompress the dataset
@@ -42,6 +109,8 @@ class SWDF(Dataset):
         with urlopen(dataset_url) as zipresp:
             with zipfile.ZipFile(BytesIO(zipresp.read())) as zfile:
                 zfile.extractall()
+        # the archive is extracted in memory, so decompression is part of the download span
+        tracing.set_attributes(decompression="included")
         bash(f"mv swdf.nt {self.dataset_path.absolute()}")
         assert self.dataset_path.exists()
 
@@ -58,12 +127,14 @@ class DBpedia2015(Dataset):
         queries_sha1 = '10c397a57f4a7d3844194c214cfb2c26ab132d01'
         assert queries_sha1 == hash_file(self.queries_path, "sha1")
 
-        old = self.queries_path.rename(f'{self.queries_path.absolute()}2')
+        old = self.queries_path.rename(self.original_queries_path)
         process_sparql_file(old, self.queries_path)
 
         # use bash to download and decompress the dataset
         dataset_url = "https://files.dice-research.org/datasets/ISWC2020_Tentris/dbpedia_2015-10_en_wo-comments_c.nt.zst"
+        # streamed through zstd without storing the compressed file, so decompression is part of the download span
         bash(f"curl -L '{dataset_url}' | zstd -d > '{self.dataset_path.absolute()}'")
+        tracing.set_attributes(decompression="included")
         assert self.dataset_path.exists()
 
 
@@ -79,12 +150,14 @@ class Wikidata(Dataset):
         queriesurl_sha1 = 'd881ea12c315669ff3ef1f8073ca553e3f9b2715'
         assert queriesurl_sha1 == hash_file(self.queries_path, "sha1")
 
-        old = self.queries_path.rename(f'{self.queries_path.absolute()}2')
+        old = self.queries_path.rename(self.original_queries_path)
         process_sparql_file(old, self.queries_path)
 
         # use bash to download and decompress the dataset
         dataset_url = "https://files.dice-research.org/datasets/hypertrie_update/wikidata/wikidata-2020-11-11-truthy-BETA-without-preparation.nt.zst"
+        # streamed through zstd without storing the compressed file, so decompression is part of the download span
         bash(f"curl -L '{dataset_url}' | zstd -d > '{self.dataset_path.absolute()}'")
+        tracing.set_attributes(decompression="included")
         assert self.dataset_path.exists()
 
 
@@ -97,11 +170,144 @@ class Watdiv(Dataset):
         # generated queries hasn't been uploaded yet
         shutil.copy(Path("watdiv_queries.txt"), self.queries_path)
 
-        old = self.queries_path.rename(f'{self.queries_path.absolute()}2')
+        old = self.queries_path.rename(self.original_queries_path)
         process_sparql_file(old, self.queries_path)
 
         # download dataset
         dataset_url = "https://dsg.uwaterloo.ca/watdiv/watdiv.1000M.tar.bz2"
+        # streamed through tar without storing the archive, so decompression is part of the download span
         bash(f"curl -L '{dataset_url}' | tar -xOjf - > '{self.dataset_path.absolute()}'")
+        tracing.set_attributes(decompression="included")
         assert self.dataset_path.exists()
 
+
+
+class SubsetDataset(Dataset):
+    """
+    Deterministic sample of another dataset. A triple belongs to the sample if the hash of its subject falls below
+    the fraction, so all triples of a subject are kept together and a sample is a superset of every smaller sample
+    of the same parent. Queries are kept if their triple patterns still match the sample.
+    """
+
+    def __init__(self, parent: Dataset, fraction: float, seed: int = 0):
+        assert 0 < fraction < 1
+        super().__init__(f"{parent.name}-{fraction * 100:g}pct", parent.path.parent)
+        self.parent = parent
+        self.fraction = fraction
+        self.seed = seed
+        # samples of the same parent, they are generated together in a single pass over the parent
+        self.siblings: list[SubsetDataset] = [self]
+
+    def download(self) -> None:
+        if not self.parent.is_downloaded():
+            self.parent.download()
+        generate_subsets(self.parent, [s for s in self.siblings if not s.is_downloaded()])
+
+
+def _subject_hash(subject: bytes, seed: int) -> float:
+    import hashlib
+    digest = hashlib.blake2b(subject, digest_size=8, key=seed.to_bytes(8, "little")).digest()
+    return int.from_bytes(digest, "little") / 2 ** 64
+
+
+def _split_triple(line: str) -> tuple[str, str, str] | None:
+    parts = line.split(maxsplit=2)
+    if len(parts) < 3 or parts[0].startswith("#"):
+        return None
+    obj = parts[2].rstrip()
+    if obj.endswith("."):
+        obj = obj[:-1].rstrip()
+    return parts[0], parts[1], obj
+
+
+def generate_subsets(parent: Dataset, subsets: list[SubsetDataset]) -> None:
+    """
+    Stream the parent dataset once and write all given samples of it, together with their filtered queries.
+    """
+    from bgp import parse_bgp, is_variable, UnsupportedQueryError
+    if not subsets:
+        return
+    subsets = sorted(subsets, key=lambda s: s.fraction)
+    fractions = [s.fraction for s in subsets]
+    seed = subsets[0].seed
+    assert all(s.seed == seed for s in subsets)
+
+    # collect the triple patterns of all simplified and original queries
+    query_files = [(parent.queries_path, lambda subset: subset.queries_path)]
+    if parent.original_queries_path.exists():
+        query_files.append((parent.original_queries_path, lambda subset: subset.original_queries_path))
+    patterns: dict[tuple[str, str, str], int] = {}  # pattern -> id
+    queries: dict[Path, list[tuple[str, list[int] | None]]] = {}  # source -> (line, pattern ids or None)
+    for source, _ in query_files:
+        queries[source] = []
+        with open(source) as f:
+            for line in f:
+                try:
+                    _, bgp = parse_bgp(line)
+                except UnsupportedQueryError:
+                    queries[source].append((line, None))
+                    continue
+                ids = [patterns.setdefault(p.terms, len(patterns)) for p in bgp]
+                queries[source].append((line, ids))
+
+    # index the patterns by their bound positions, so every triple needs at most 8 lookups
+    index: dict[tuple[bool, bool, bool], dict[tuple, list[int]]] = {}
+    for terms, pattern_id in patterns.items():
+        mask = tuple(not is_variable(t) for t in terms)
+        key = tuple(t for t, bound in zip(terms, mask) if bound)
+        index.setdefault(mask, {}).setdefault(key, []).append(pattern_id)
+    # smallest sample level in which each pattern has a match
+    pattern_level = [len(subsets)] * len(patterns)
+
+    with tracing.span("subset", dataset=parent.name, fractions=fractions):
+        # invalid UTF-8 in the dump is passed through unchanged, like it is read
+        outputs = [open(s.dataset_path, "w", encoding="utf-8", errors="surrogateescape") for s in subsets]
+        triples = [0] * len(subsets)
+        try:
+            with open(parent.dataset_path, encoding="utf-8", errors="surrogateescape") as f:
+                for line in f:
+                    triple = _split_triple(line)
+                    if triple is None:
+                        continue
+                    u = _subject_hash(triple[0].encode("utf-8", "surrogateescape"), seed)
+                    level = next((i for i, fraction in enumerate(fractions) if u < fraction), len(subsets))
+                    if level == len(subsets):
+                        continue
+                    for i in range(level, len(subsets)):
+                        outputs[i].write(line)
+                        triples[i] += 1
+                    for mask, keys in index.items():
+                        for pattern_id in keys.get(tuple(t for t, bound in zip(triple, mask) if bound), ()):
+                            pattern_level[pattern_id] = min(pattern_level[pattern_id], level)
+        except BaseException:
+            # don't leave partial samples behind that look complete
+            for output, subset in zip(outputs, subsets):
+                output.close()
+                subset.dataset_path.unlink(missing_ok=True)
+            raise
+        finally:
+            for output in outputs:
+                output.close()
+
+    for level, subset in enumerate(subsets):
+        kept = {}
+        for source, dest in query_files:
+            kept[source.name] = 0
+            with open(dest(subset), "w") as f:
+                for line, ids in queries[source]:
+                    if ids is not None and all(pattern_level[i] <= level for i in ids):
+                        f.write(line)
+                        kept[source.name] += 1
+        # the triple count is known already, so the statistics don't need another pass
+        stat = subset.dataset_path.stat()
+        subset.statistics_path.write_text(json.dumps({
+            "file": {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns},
+            "triples": triples[level],
+        }, indent=2))
+        subset.path.joinpath("subset.json").write_text(json.dumps({
+            "parent": parent.name,
+            "fraction": subset.fraction,
+            "seed": seed,
+            "triples": triples[level],
+            "queries": kept,
+        }, indent=2))
@@ -0,0 +1,175 @@
+"""
+Storage footprint of database directories.
+
+Replaces `du -bs` with a parallel `os.scandir` walk that reports apparent and allocated bytes (sparse files and
+preallocation make them differ), counts hard linked files once (snapshots sharing files with the database), and
+breaks the footprint down per file and per component.
+"""
+import csv
+import logging
+import os
+import re
+import stat
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+
+
+@dataclass
+class FileFootprint:
+    path: str  # relative to the analyzed directory
+    apparent_bytes: int
+    allocated_bytes: int
+
+
+@dataclass
+class Footprint:
+    apparent_bytes: int = 0
+    allocated_bytes: int = 0
+    files: int = 0
+    directories: int = 0
+    hardlinks_skipped: int = 0
+    components: dict[str, dict[str, int]] = field(default_factory=dict)
+    largest_files: list[FileFootprint] = field(default_factory=list)
+
+    def bits_per_triple(self, triples: int, allocated: bool = False) -> float | None:
+        if not triples:
+            return None
+        return (self.allocated_bytes if allocated else self.apparent_bytes) * 8 / triples
+
+    def to_json(self, triples: int | None = None) -> dict:
+        result = asdict(self)
+        if triples:
+            result["triples"] = triples
+            result["bits_per_triple"] = self.bits_per_triple(triples)
+            result["allocated_bits_per_triple"] = self.bits_per_triple(triples, allocated=True)
+        return result
+
+
+def component_of(relative_path: str) -> str:
+    """
+    Group files into components: the top level directory, and within it the file name with numbers replaced,
+    so that e.g. `data-0001.idx` and `data-0002.idx` end up in the same component.
+    """
+    parts = relative_path.split(os.sep)
+    name = re.sub(r"\d+", "N", parts[-1])
+    return name if len(parts) == 1 else f"{parts[0]}/{name}"
+
+
+def _scan_tree(root: str, workers: int, footprint: Footprint) -> list[FileFootprint]:
+    """Scan the directories in parallel, counts directories and skipped hard links in `footprint`."""
+    lock = threading.Lock()
+    seen_inodes: set[tuple[int, int]] = set()
+    files: list[FileFootprint] = []
+    pending = [0]
+    done = threading.Event()
+
+    def scan(path: str) -> None:
+        subdirectories = []
+        local_files = []
+        skipped = 0
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirectories.append(entry.path)
+                            continue
+                        st = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    if not stat.S_ISREG(st.st_mode):
+                        continue
+                    if st.st_nlink > 1:
+                        with lock:
+                            if (st.st_dev, st.st_ino) in seen_inodes:
+                                skipped += 1
+                                continue
+                            seen_inodes.add((st.st_dev, st.st_ino))
+                    local_files.append(FileFootprint(os.path.relpath(entry.path, root), st.st_size,
+                                                     st.st_blocks * 512))
+        except OSError as e:
+            logging.debug(f"Could not scan {path}: {e}")
+        finally:
+            with lock:
+                files.extend(local_files)
+                footprint.directories += 1
+                footprint.hardlinks_skipped += skipped
+                pending[0] += len(subdirectories) - 1
+                finished = pending[0] == 0
+            for subdirectory in subdirectories:
+                executor.submit(scan, subdirectory)
+            if finished:
+                done.set()
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="footprint") as executor:
+        pending[0] = 1
+        executor.submit(scan, root)
+        done.wait()
+    return files
+
+
+def analyze(directory: Path, workers: int = 16, top_files: int = 20) -> Footprint:
+    """
+    Walk the directory tree in parallel and sum up the sizes of all files. A single file is analyzed by itself.
+    :param workers:     Number of threads scanning directories concurrently
+    :param top_files:   Number of largest files to report
+    """
+    footprint = Footprint()
+    if not directory.exists():
+        return footprint
+    if directory.is_file():
+        # e.g. ITR stores its database as a single file
+        st = directory.stat()
+        files = [FileFootprint(directory.name, st.st_size, st.st_blocks * 512)]
+    else:
+        files = _scan_tree(str(directory), workers, footprint)
+
+    for f in files:
+        footprint.apparent_bytes += f.apparent_bytes
+        footprint.allocated_bytes += f.allocated_bytes
+        component = footprint.components.setdefault(component_of(f.path),
+                                                    {"files": 0, "apparent_bytes": 0, "allocated_bytes": 0})
+        component["files"] += 1
+        component["apparent_bytes"] += f.apparent_bytes
+        component["allocated_bytes"] += f.allocated_bytes
+    footprint.files = len(files)
+    footprint.components = dict(sorted(footprint.components.items(), key=lambda c: -c[1]["apparent_bytes"]))
+    footprint.largest_files = sorted(files, key=lambda f: -f.apparent_bytes)[:top_files]
+    return footprint
+
+
+class FootprintMonitor(threading.Thread):
+    """Samples the footprint of a directory in the background, e.g. while a loader writes the database."""
+
+    def __init__(self, directory: Path, interval_seconds: float = 30, workers: int = 4) -> None:
+        super().__init__(name=f"footprint-{directory.name}", daemon=True)
+        self.directory = directory
+        self.interval_seconds = interval_seconds
+        self.workers = workers
+        self.samples: list[tuple[float, int, int, int]] = []  # (elapsed s, apparent, allocated, files)
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        start = time.perf_counter()
+        while not self._stop_event.is_set():
+            footprint = analyze(self.directory, workers=self.workers, top_files=0)
+            self.samples.append((time.perf_counter() - start, footprint.apparent_bytes, footprint.allocated_bytes,
+                                 footprint.files))
+            self._stop_event.wait(self.interval_seconds)
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+    def peak_bytes(self) -> int:
+        return max((apparent for _, apparent, _, _ in self.samples), default=0)
+
+    def write_csv(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["elapsed_s", "apparent_bytes", "allocated_bytes", "files"])
+            writer.writerows(self.samples)
@@ -5,8 +5,9 @@ import logging
 from string import Template
 from dataclasses import dataclass
 
-from triplestore import Triplestore, DatabaseVersion
+from triplestore import Triplestore
 from dataset import Dataset
+import tracing
 import util
 
 
@@ -100,32 +101,23 @@ class Iguana:
 
         return True
 
-    def run_benchmark(self, triplestore: Triplestore, benchmark: Dataset, configuration: IguanaConfiguration) -> None:
-        # loading dataset into triplestore
-        if not triplestore.is_database_loaded(benchmark):
-            logging.info(f"The {benchmark.name} dataset hasn't been loaded into {triplestore.name} yet. Loading now.")
-            db = triplestore.load(benchmark)
-            logging.info(f"Loaded {benchmark.name} dataset into {triplestore.name}.")
-        else:
-            import datetime
-            db = DatabaseVersion(datetime.datetime.now(), benchmark)
-
-        # starting triplestore
-        logging.info(f"Starting {triplestore.name}.")
-        handle = triplestore.start(db)
-        triplestore_running = lambda: handle.poll() is None
-        assert triplestore_running()
-        logging.info(f"Waiting for {triplestore.name} to initialize")
-        util.wait_until_available(triplestore.sparql_endpoint, timeout=20 * 60)  # up to 20 minutes
-        logging.info(f"Started {triplestore.name}.")
-
-        # running benchmark
-        logging.info(f"Running benchmark {configuration.name}.")
-        subprocess.run([f"{self.executable_path}", configuration.path], check=True)
-        assert triplestore_running()
-        logging.info(f"Finished benchmark {configuration.name}.")
-
-        # stopping triplestore
-        logging.info(f"Stopping {triplestore.name}.")
-        triplestore.stop(handle)
-        assert not triplestore_running()
+    def run_benchmark(self, triplestore: Triplestore, benchmark: Dataset, configuration: IguanaConfiguration) -> float:
+        """
+        Load the dataset if necessary, start the triplestore and run the benchmark configuration against it.
+        :return: The wall clock time of the benchmark in seconds, without loading, starting and stopping
+        """
+        import time
+        db = triplestore.ensure_loaded(benchmark)
+        with triplestore.running(db) as handle:
+            # running benchmark
+            logging.info(f"Running benchmark {configuration.name}.")
+            # iguana runs the warmup and the measurement task in one invocation, so they can't be traced separately
+            with tracing.span("measure", configuration=configuration.name, includes_warmup=True,
+                              warmup_query_runs=configuration.values.get("warmup_query_runs"),
+                              query_runs=configuration.values.get("query_runs")):
+                elapsed = time.perf_counter()
+                subprocess.run([f"{self.executable_path}", configuration.path], check=True)
+                elapsed = time.perf_counter() - elapsed
+            assert handle.poll() is None
+            logging.info(f"Finished benchmark {configuration.name}.")
+        return elapsed
@@ -0,0 +1,238 @@
+"""
+Live progress telemetry for loader processes.
+
+Loaders don't report progress, but Linux exposes how far a process has read into its input file: the file
+position in `/proc/<pid>/fdinfo/<fd>` and the read counters in `/proc/<pid>/io`. Together with the triple count of
+the dataset this gives triples/sec and an ETA while the loader runs.
+"""
+import csv
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from subprocess import Popen
+
+import psutil
+
+
+class LoadFailedError(RuntimeError):
+    """The loader exited unsuccessfully, e.g. because it was killed by the memory limit."""
+
+
+class LoadAbortedError(LoadFailedError):
+    """The projected load time exceeded `max_load_seconds`, so the loader was terminated."""
+
+
+@dataclass
+class ProgressSample:
+    elapsed_s: float
+    position: int  # bytes of the input file consumed so far
+    position_source: str  # "fdinfo", "rchar" or "none"
+    rchar: int  # bytes read by the loader processes in total, including other files
+    read_bytes: int  # bytes actually fetched from storage by the loader processes
+    rss: int
+    triples: int  # estimated triples parsed so far
+    triples_per_s: float
+    eta_s: float | None
+    phase: str  # "parsing", "stalled", "post-parse", "estimated" (position from rchar) or "unknown"
+
+
+class LoadProgressMonitor(threading.Thread):
+    """
+    Samples the read progress of a loader process (and its children) in a background thread until it exits.
+    :param proc:                The loader process
+    :param input_path:          The input file the loader reads, usually `dataset.nt`
+    :param total_triples:       Number of triples in the input file, used for triples/sec and the ETA
+    :param interval_seconds:    Sampling interval
+    :param stall_seconds:       Report a stall if the position doesn't move for this long while parsing
+    :param max_load_seconds:    Terminate the loader if the projected load time exceeds this limit, only projections
+                                from the input file position are trusted for this
+    :param rate_window:         Number of samples the current rate is averaged over
+    """
+
+    def __init__(self, proc: Popen, input_path: Path, total_triples: int | None = None, interval_seconds: float = 5,
+                 stall_seconds: float = 120, max_load_seconds: float | None = None, rate_window: int = 12) -> None:
+        super().__init__(name=f"load-monitor-{proc.pid}", daemon=True)
+        self.proc = proc
+        self.input_path = Path(os.path.realpath(input_path))
+        self.input_size = self.input_path.stat().st_size
+        self.total_triples = total_triples
+        self.interval_seconds = interval_seconds
+        self.stall_seconds = stall_seconds
+        self.max_load_seconds = max_load_seconds
+        self.rate_window = rate_window
+        self.samples: list[ProgressSample] = []
+        self.aborted = False
+        self.parse_finished_s: float | None = None
+        self._open_fds: dict[int, int] = {}  # pid -> fd of the input file
+        self._last_position = 0
+
+    @property
+    def bytes_per_triple(self) -> float | None:
+        if not self.total_triples:
+            return None
+        return self.input_size / self.total_triples
+
+    def _processes(self) -> list[psutil.Process]:
+        try:
+            root = psutil.Process(self.proc.pid)
+            return [root] + root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return []
+
+    def _find_input_fd(self, pid: int) -> int | None:
+        fd_dir = f"/proc/{pid}/fd"
+        try:
+            fds = os.listdir(fd_dir)
+        except OSError:
+            return None
+        for fd in fds:
+            try:
+                if os.readlink(f"{fd_dir}/{fd}") == str(self.input_path):
+                    return int(fd)
+            except OSError:
+                continue
+        return None
+
+    def _fd_position(self, pid: int, fd: int) -> int | None:
+        try:
+            # the fd might have been closed and reused for another file in the meantime
+            if os.readlink(f"/proc/{pid}/fd/{fd}") != str(self.input_path):
+                return None
+            with open(f"/proc/{pid}/fdinfo/{fd}") as f:
+                for line in f:
+                    if line.startswith("pos:"):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+        return None
+
+    def _input_position(self, processes: list[psutil.Process]) -> int | None:
+        positions = []
+        for process in processes:
+            fd = self._open_fds.get(process.pid)
+            position = self._fd_position(process.pid, fd) if fd is not None else None
+            if position is None:
+                fd = self._find_input_fd(process.pid)
+                if fd is None:
+                    self._open_fds.pop(process.pid, None)
+                    continue
+                self._open_fds[process.pid] = fd
+                position = self._fd_position(process.pid, fd)
+            if position is not None:
+                positions.append(position)
+        return max(positions) if positions else None
+
+    def sample(self, elapsed_s: float) -> ProgressSample:
+        processes = self._processes()
+        rchar = read_bytes = rss = 0
+        for process in processes:
+            try:
+                io = process.io_counters()
+                rchar += io.read_chars
+                read_bytes += io.read_bytes
+                rss += process.memory_info().rss
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+
+        position = self._input_position(processes)
+        source = "fdinfo"
+        if position is not None:
+            self._last_position = position
+        elif self._last_position >= 0.99 * self.input_size:
+            # input file was closed after reading (nearly) all of it
+            position = self._last_position = self.input_size
+        elif self._last_position > 0:
+            # closed early, e.g. after sniffing the format, keep the last known position until it's reopened
+            position = self._last_position
+        elif rchar > 0:
+            # e.g. memory mapped input, fall back to all bytes read by the loader
+            position, source = min(rchar, self.input_size), "rchar"
+        else:
+            position, source = 0, "none"
+
+        # don't mix positions from different sources when computing the rate
+        window = [s for s in self.samples[-self.rate_window:] if s.position_source == source]
+        previous = window[0] if window else None
+        rate = 0.0
+        if previous is not None and elapsed_s > previous.elapsed_s:
+            rate = (position - previous.position) / (elapsed_s - previous.elapsed_s)
+
+        bytes_per_triple = self.bytes_per_triple
+        triples = int(position / bytes_per_triple) if bytes_per_triple else 0
+        triples_per_s = rate / bytes_per_triple if bytes_per_triple else 0.0
+        eta_s = (self.input_size - position) / rate if rate > 0 else None
+
+        if source == "rchar":
+            # rchar counts every byte the loader read, e.g. jars during startup, so this is only an estimate
+            phase = "estimated"
+        elif position >= self.input_size:
+            phase = "post-parse"
+            if self.parse_finished_s is None:
+                self.parse_finished_s = elapsed_s
+                logging.info(f"Loader finished reading {self.input_path.name} after {elapsed_s:.0f}s, "
+                             f"now building the database.")
+            eta_s = 0.0
+        elif source == "none":
+            phase = "unknown"
+        elif self._stalled(position, elapsed_s):
+            phase = "stalled"
+        else:
+            phase = "parsing"
+
+        return ProgressSample(elapsed_s, position, source, rchar, read_bytes, rss, triples, triples_per_s, eta_s,
+                              phase)
+
+    def _stalled(self, position: int, elapsed_s: float) -> bool:
+        for sample in reversed(self.samples):
+            if sample.position != position:
+                return False
+            if elapsed_s - sample.elapsed_s >= self.stall_seconds:
+                return True
+        return False
+
+    def run(self) -> None:
+        start = time.perf_counter()
+        was_stalled = False
+        while self.proc.poll() is None:
+            elapsed_s = time.perf_counter() - start
+            sample = self.sample(elapsed_s)
+            self.samples.append(sample)
+
+            if sample.phase == "stalled" and not was_stalled:
+                logging.warning(f"Loader made no progress reading {self.input_path.name} "
+                                f"for {self.stall_seconds}s at byte {sample.position}.")
+            was_stalled = sample.phase == "stalled"
+            if sample.phase == "parsing" and len(self.samples) % self.rate_window == 0:
+                eta = f"{sample.eta_s:.0f}s" if sample.eta_s is not None else "unknown"
+                logging.info(f"Loading {self.input_path.name}: {sample.position / self.input_size:.1%}, "
+                             f"{sample.triples_per_s:,.0f} triples/s, ETA {eta}.")
+
+            if (self.max_load_seconds is not None and sample.phase == "parsing" and sample.eta_s is not None
+                    and elapsed_s + sample.eta_s > self.max_load_seconds):
+                logging.error(f"Projected load time {elapsed_s + sample.eta_s:.0f}s exceeds the limit of "
+                              f"{self.max_load_seconds}s. Aborting the load.")
+                self.aborted = True
+                self.proc.terminate()
+                break
+            time.sleep(self.interval_seconds)
+
+    def summary(self) -> dict:
+        parsing = [s.triples_per_s for s in self.samples if s.phase == "parsing" and s.triples_per_s > 0]
+        return {
+            "parse_s": self.parse_finished_s,
+            "mean_triples_per_s": sum(parsing) / len(parsing) if parsing else None,
+            "peak_triples_per_s": max(parsing) if parsing else None,
+            "stalled_samples": sum(1 for s in self.samples if s.phase == "stalled"),
+            "aborted": self.aborted,
+        }
+
+    def write_csv(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(ProgressSample.__dataclass_fields__))
+            writer.writeheader()
+            for sample in self.samples:
+                writer.writerow(asdict(sample))
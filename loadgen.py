@@ -0,0 +1,404 @@
+"""
+Distributed load generator for SPARQL endpoints.
+
+A coordinator partitions the queries over several agent processes, possibly on other hosts, and lets them start at
+the same time. Every agent sends its queries from a number of threads and streams latency histograms back to the
+coordinator, which merges them. Aggregate throughput is therefore not limited by a single client process.
+
+    python3 loadgen.py coordinator http://localhost:8080/ queries.txt --local-agents 4
+    LOADGEN_AUTHKEY=<key> python3 loadgen.py agent coordinator-host:47000  # additional agents on other hosts
+
+Agents on other hosts start at the wall clock time sent by the coordinator, so the clocks need to be synchronized
+(e.g. with NTP).
+
+Coordinator and agents exchange pickled messages, so they authenticate each other with a shared key read from the
+`LOADGEN_AUTHKEY` environment variable. For a coordinator listening only on the loopback interface a random key is
+generated and handed to the local agents through their environment, listening on other interfaces requires the key.
+"""
+import argparse
+import csv
+import ipaddress
+import json
+import logging
+import os
+import secrets
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Connection, Listener, wait
+from pathlib import Path
+
+import requests
+
+import tracing
+
+DEFAULT_PORT = 47000
+AUTHKEY_ENV = "LOADGEN_AUTHKEY"
+QUANTILES = {"p50": 0.5, "p90": 0.9, "p99": 0.99, "p999": 0.999}
+
+
+class LatencyHistogram:
+    """
+    Log-linear histogram of latencies in microseconds: every power of two is split into 2^SUB_BUCKET_BITS buckets,
+    so the relative error is below 2^-SUB_BUCKET_BITS. Histograms are merged by adding the bucket counts.
+    """
+    SUB_BUCKET_BITS = 5
+
+    def __init__(self) -> None:
+        self.counts: dict[int, int] = {}
+        self.total = 0
+        self.sum_us = 0
+        self.max_us = 0
+
+    @classmethod
+    def bucket(cls, value_us: int) -> int:
+        shift = value_us.bit_length() - cls.SUB_BUCKET_BITS - 1
+        if shift <= 0:
+            return value_us
+        return (shift << cls.SUB_BUCKET_BITS) + (value_us >> shift)
+
+    @classmethod
+    def bucket_value(cls, bucket: int) -> int:
+        """Midpoint of the values in the bucket."""
+        shift = (bucket >> cls.SUB_BUCKET_BITS) - 1
+        if shift <= 0:
+            return bucket
+        return ((bucket - (shift << cls.SUB_BUCKET_BITS)) << shift) + (1 << (shift - 1))
+
+    def record(self, value_us: int) -> None:
+        bucket = self.bucket(value_us)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.total += 1
+        self.sum_us += value_us
+        self.max_us = max(self.max_us, value_us)
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.total += other.total
+        self.sum_us += other.sum_us
+        self.max_us = max(self.max_us, other.max_us)
+
+    def quantile(self, q: float) -> int | None:
+        if not self.total:
+            return None
+        rank = q * self.total
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(self.bucket_value(bucket), self.max_us)
+        return self.max_us
+
+    def summary(self) -> dict:
+        return {
+            "requests": self.total,
+            "mean_us": self.sum_us / self.total if self.total else None,
+            **{f"{name}_us": self.quantile(q) for name, q in QUANTILES.items()},
+            "max_us": self.max_us,
+        }
+
+    def to_dict(self) -> dict:
+        return {"counts": self.counts, "total": self.total, "sum_us": self.sum_us, "max_us": self.max_us}
+
+    @staticmethod
+    def from_dict(data: dict) -> "LatencyHistogram":
+        histogram = LatencyHistogram()
+        histogram.counts = {int(bucket): count for bucket, count in data["counts"].items()}
+        histogram.total = data["total"]
+        histogram.sum_us = data["sum_us"]
+        histogram.max_us = data["max_us"]
+        return histogram
+
+
+def _parse_address(address: str) -> tuple[str, int]:
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def _is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def _environment_authkey() -> bytes | None:
+    key = os.environ.get(AUTHKEY_ENV)
+    return key.encode() if key else None
+
+
+class Agent:
+    """
+    Connects to the coordinator, waits for its assignment and sends the assigned queries until the duration is over.
+    :param authkey: Key shared with the coordinator
+    :param threads: Concurrent requests of this agent, overrides the coordinator's setting
+    """
+
+    def __init__(self, coordinator: str, authkey: bytes, threads: int | None = None) -> None:
+        self.coordinator = coordinator
+        self.authkey = authkey
+        self.threads = threads
+        self._lock = threading.Lock()
+        self._histogram = LatencyHistogram()
+        self._errors = 0
+        self._timeouts = 0
+        self._finished = 0.0
+
+    def _worker(self, assignment: dict, offset: int, stride: int, deadline: float) -> None:
+        queries = assignment["queries"]
+        session = requests.Session()
+        position = offset
+        while time.perf_counter() < deadline:
+            query = queries[position % len(queries)]
+            position += stride
+            start = time.perf_counter_ns()
+            try:
+                response = session.get(assignment["endpoint"], params={"query": query},
+                                       timeout=assignment["timeout_seconds"],
+                                       headers={"Accept": "application/sparql-results+json"})
+                _ = response.content
+                latency_us = (time.perf_counter_ns() - start) // 1000
+                with self._lock:
+                    if response.status_code == 200:
+                        self._histogram.record(latency_us)
+                    else:
+                        self._errors += 1
+            except requests.Timeout:
+                with self._lock:
+                    self._timeouts += 1
+            except requests.RequestException:
+                with self._lock:
+                    self._errors += 1
+        session.close()
+        with self._lock:
+            self._finished = max(self._finished, time.perf_counter())
+
+    def _take_report(self) -> dict:
+        with self._lock:
+            histogram, self._histogram = self._histogram, LatencyHistogram()
+            report = {"histogram": histogram.to_dict(), "errors": self._errors, "timeouts": self._timeouts}
+            self._errors = self._timeouts = 0
+        return report
+
+    def run(self) -> None:
+        with Client(_parse_address(self.coordinator), authkey=self.authkey) as connection:
+            assignment = connection.recv()
+            threads = self.threads or assignment["threads"]
+            if not assignment["queries"]:
+                connection.send({"type": "done", "elapsed_s": 0.0, **self._take_report()})
+                return
+            # wait for the common start time
+            time.sleep(max(0.0, assignment["start_at"] - time.time()))
+            start = time.perf_counter()
+            deadline = start + assignment["duration_s"]
+            workers = [threading.Thread(target=self._worker, args=(assignment, i, threads, deadline),
+                                        name=f"loadgen-{i}", daemon=True) for i in range(threads)]
+            for worker in workers:
+                worker.start()
+            while any(worker.is_alive() for worker in workers):
+                # report at the interval, but return as soon as the workers are done
+                report_at = time.perf_counter() + assignment["report_interval_s"]
+                for worker in workers:
+                    worker.join(max(0.0, report_at - time.perf_counter()))
+                connection.send({"type": "report", "elapsed_s": time.perf_counter() - start, **self._take_report()})
+            connection.send({"type": "done", "elapsed_s": self._finished - start, **self._take_report()})
+
+
+class LoadCoordinator:
+    """
+    :param endpoint:            URL of the SPARQL endpoint the agents send their queries to
+    :param queries_path:        One query per line, partitioned round-robin over the agents
+    :param agents:              Number of agents to wait for, including the local ones
+    :param local_agents:        Agent processes started on this host
+    :param threads:             Concurrent requests per agent
+    :param duration_s:          Duration of the load phase
+    :param start_delay_s:       Time between sending the assignments and the common start
+    :param address:             Address the coordinator listens on for agents
+    :param authkey:             Key shared with the agents, defaults to `LOADGEN_AUTHKEY` and is generated randomly
+                                if that is not set and the address is a loopback address
+    :param connect_timeout_s:   Fail if not all agents connected within this time
+    """
+
+    def __init__(self, endpoint: str, queries_path: Path, agents: int = 4, local_agents: int | None = None,
+                 threads: int = 4, duration_s: float = 60, timeout_seconds: float = 180, start_delay_s: float = 2,
+                 report_interval_s: float = 1, address: tuple[str, int] = ("127.0.0.1", DEFAULT_PORT),
+                 authkey: bytes | None = None, connect_timeout_s: float = 60) -> None:
+        authkey = authkey or _environment_authkey()
+        if authkey is None:
+            if not _is_loopback(address[0]):
+                raise ValueError(f"Listening on {address[0]} requires a key shared with the agents, "
+                                 f"set {AUTHKEY_ENV}.")
+            authkey = secrets.token_hex(32).encode()
+        if local_agents is not None and local_agents > agents:
+            raise ValueError(f"Cannot start {local_agents} local agents when only waiting for {agents} agents.")
+        self.endpoint = endpoint
+        self.queries_path = queries_path
+        self.agents = agents
+        self.local_agents = agents if local_agents is None else local_agents
+        self.threads = threads
+        self.duration_s = duration_s
+        self.timeout_seconds = timeout_seconds
+        self.start_delay_s = start_delay_s
+        self.report_interval_s = report_interval_s
+        self.address = address
+        self.authkey = authkey
+        self.connect_timeout_s = connect_timeout_s
+
+    def _start_local_agents(self, port: int) -> list[subprocess.Popen]:
+        # the key is passed through the environment, the command line is visible to other users
+        env = {**os.environ, AUTHKEY_ENV: self.authkey.decode()}
+        return [subprocess.Popen([sys.executable, str(Path(__file__).absolute()), "agent", f"127.0.0.1:{port}"],
+                                 env=env)
+                for _ in range(self.local_agents)]
+
+    def _accept_agents(self, listener: Listener, processes: list[subprocess.Popen]) -> list[Connection]:
+        """
+        Accept the agent connections in a background thread, so that local agents exiting before they connected and
+        agents that never connect fail the run instead of blocking it.
+        """
+        connections: list[Connection] = []
+
+        def accept() -> None:
+            while len(connections) < self.agents:
+                try:
+                    connections.append(listener.accept())
+                except (AuthenticationError, ConnectionError, EOFError) as e:
+                    logging.warning(f"Rejected a load agent connection: {e!r}")
+                except OSError:
+                    return  # the listener was closed
+
+        acceptor = threading.Thread(target=accept, name="loadgen-accept", daemon=True)
+        acceptor.start()
+        deadline = time.perf_counter() + self.connect_timeout_s
+        while True:
+            acceptor.join(0.2)
+            if not acceptor.is_alive():
+                return connections
+            if exited := [process.returncode for process in processes if process.poll() is not None]:
+                error = f"local load agents exited with status {exited} before all agents connected"
+            elif time.perf_counter() > deadline:
+                error = (f"only {len(connections)} of {self.agents} load agents connected within "
+                         f"{self.connect_timeout_s}s")
+            else:
+                continue
+            listener.close()
+            for process in processes:
+                process.terminate()
+            for connection in connections:
+                connection.close()
+            raise RuntimeError(f"Distributed load failed: {error}.")
+
+    def run(self, results_dir: Path | None = None) -> dict:
+        with open(self.queries_path) as f:
+            queries = [line.strip() for line in f if line.strip()]
+
+        with Listener(self.address, authkey=self.authkey) as listener:
+            port = listener.address[1]
+            processes = self._start_local_agents(port)
+            logging.info(f"Load coordinator listening on port {port}, waiting for {self.agents} agents.")
+            connections = self._accept_agents(listener, processes)
+
+        histogram = LatencyHistogram()
+        per_agent = [{"requests": 0, "errors": 0, "timeouts": 0, "elapsed_s": None} for _ in connections]
+        timeline: dict[int, int] = {}  # second of the load phase -> completed requests
+        with tracing.span("measure", mode="distributed", agents=self.agents, threads=self.threads,
+                          queries=len(queries)) as span:
+            start_at = time.time() + self.start_delay_s
+            for i, connection in enumerate(connections):
+                connection.send({
+                    "endpoint": self.endpoint,
+                    "queries": queries[i::len(connections)],
+                    "threads": self.threads,
+                    "start_at": start_at,
+                    "duration_s": self.duration_s,
+                    "timeout_seconds": self.timeout_seconds,
+                    "report_interval_s": self.report_interval_s,
+                })
+
+            active = dict(enumerate(connections))
+            while active:
+                for connection in wait(list(active.values())):
+                    agent = next(i for i, c in active.items() if c is connection)
+                    try:
+                        message = connection.recv()
+                    except EOFError:
+                        logging.warning(f"Load agent {agent} disconnected before finishing.")
+                        del active[agent]
+                        continue
+                    report = LatencyHistogram.from_dict(message["histogram"])
+                    histogram.merge(report)
+                    per_agent[agent]["requests"] += report.total
+                    per_agent[agent]["errors"] += message["errors"]
+                    per_agent[agent]["timeouts"] += message["timeouts"]
+                    second = int(message["elapsed_s"])
+                    timeline[second] = timeline.get(second, 0) + report.total
+                    if message["type"] == "done":
+                        per_agent[agent]["elapsed_s"] = message["elapsed_s"]
+                        connection.close()
+                        del active[agent]
+            span.set(requests=histogram.total)
+
+        for process in processes:
+            process.wait()
+
+        elapsed = max((agent["elapsed_s"] or 0 for agent in per_agent), default=0)
+        result = {
+            "endpoint": self.endpoint,
+            "agents": self.agents,
+            "threads_per_agent": self.threads,
+            "duration_s": elapsed,
+            "throughput_qps": histogram.total / elapsed if elapsed else 0.0,
+            "errors": sum(agent["errors"] for agent in per_agent),
+            "timeouts": sum(agent["timeouts"] for agent in per_agent),
+            "latency": histogram.summary(),
+            "per_agent": per_agent,
+        }
+        logging.info(f"Distributed load: {histogram.total} requests in {elapsed:.1f}s "
+                     f"({result['throughput_qps']:.0f} queries/s), p50 {result['latency']['p50_us']}µs, "
+                     f"p99 {result['latency']['p99_us']}µs.")
+        if results_dir is not None:
+            results_dir.mkdir(parents=True, exist_ok=True)
+            results_dir.joinpath("loadgen.json").write_text(json.dumps(result, indent=2))
+            results_dir.joinpath("loadgen_histogram.json").write_text(json.dumps(histogram.to_dict()))
+            with open(results_dir.joinpath("loadgen_timeline.csv"), "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(["second", "requests"])
+                writer.writerows(sorted(timeline.items()))
+        return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distributed load generator for SPARQL endpoints.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    coordinator = commands.add_parser("coordinator", help="partition the queries and merge the agents' results")
+    coordinator.add_argument("endpoint", help="endpoint URL, e.g. http://localhost:8080/")
+    coordinator.add_argument("queries", type=Path, help="file with one query per line")
+    coordinator.add_argument("--agents", type=int, default=4)
+    coordinator.add_argument("--local-agents", type=int, default=None, help="defaults to --agents")
+    coordinator.add_argument("--threads", type=int, default=4, help="concurrent requests per agent")
+    coordinator.add_argument("--duration", type=float, default=60, help="seconds")
+    coordinator.add_argument("--timeout", type=float, default=180, help="seconds")
+    coordinator.add_argument("--listen", default=f"127.0.0.1:{DEFAULT_PORT}",
+                             help=f"use 0.0.0.0:<port> for agents on other hosts, requires {AUTHKEY_ENV}")
+    coordinator.add_argument("--connect-timeout", type=float, default=60, help="seconds to wait for the agents")
+    coordinator.add_argument("--results", type=Path, default=None, help="directory for the result files")
+    agent = commands.add_parser("agent", help="connect to a coordinator and generate load")
+    agent.add_argument("coordinator", help="host:port of the coordinator")
+    agent.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "agent":
+        if (authkey := _environment_authkey()) is None:
+            parser.error(f"{AUTHKEY_ENV} has to be set to the key of the coordinator")
+        Agent(args.coordinator, authkey, args.threads).run()
+    else:
+        result = LoadCoordinator(args.endpoint, args.queries, args.agents, args.local_agents, args.threads,
+                                 args.duration, args.timeout, address=_parse_address(args.listen),
+                                 connect_timeout_s=args.connect_timeout).run(args.results)
+        print(json.dumps(result, indent=2))
@@ -0,0 +1,356 @@
+"""
+Micro-benchmarks for the harness's own hot paths.
+
+All inputs are generated synthetically (and deterministically) from a seed, so runs on different machines or
+revisions are comparable. Results can be stored as a baseline and later runs compared against it:
+
+    python3 microbench.py --save-baseline
+    python3 microbench.py --compare --tolerance 0.1
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import dataclass, field, asdict
+from datetime import datetime
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from pathlib import Path
+from typing import Callable
+
+import util
+from query_translate import translate_to_simple_triple, process_sparql_file
+
+PREFIXES = ["http://db.uwaterloo.ca/~galuc/wsdbm/", "http://schema.org/", "http://purl.org/dc/terms/",
+            "http://www.w3.org/1999/02/22-rdf-syntax-ns#", "http://ogp.me/ns#"]
+LOCAL_NAMES = ["User", "Product", "Website", "Review", "City", "Genre", "Offer", "Retailer"]
+PREDICATES = ["likes", "subscribes", "follows", "friendOf", "caption", "text", "contentRating", "type", "tag"]
+
+
+@dataclass
+class BenchmarkResult:
+    name: str
+    unit: str  # unit of the throughput, higher is always better
+    work: float  # amount of work done per repetition, in units of `unit` * seconds
+    seconds: list[float] = field(default_factory=list)
+
+    @property
+    def best(self) -> float:
+        return min(self.seconds)
+
+    @property
+    def median(self) -> float:
+        return statistics.median(self.seconds)
+
+    @property
+    def throughput(self) -> float:
+        return self.work / self.median if self.median > 0 else float("inf")
+
+
+# ---------------------------------------------------------------------------
+# synthetic inputs
+# ---------------------------------------------------------------------------
+
+def _random_iri(rng: random.Random) -> str:
+    return f"<{rng.choice(PREFIXES)}{rng.choice(LOCAL_NAMES)}{rng.randrange(1_000_000)}>"
+
+
+def _random_predicate(rng: random.Random) -> str:
+    return f"<{rng.choice(PREFIXES)}{rng.choice(PREDICATES)}>"
+
+
+def generate_queries(count: int, seed: int = 42) -> list[str]:
+    """Generate WatDiv-like BGP queries with 1 to 5 triple patterns each, one per line."""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        variables = [f"?v{i}" for i in range(rng.randint(2, 6))]
+        patterns = []
+        for _ in range(rng.randint(1, 5)):
+            subject = rng.choice(variables) if rng.random() < 0.8 else _random_iri(rng)
+            obj = rng.choice(variables) if rng.random() < 0.6 else _random_iri(rng)
+            patterns.append(f"{subject} {_random_predicate(rng)} {obj} .")
+        queries.append(f"SELECT {' '.join(variables)} WHERE {{ {' '.join(patterns)} }}")
+    return queries
+
+
+def generate_ntriples(dest: Path, size_bytes: int, seed: int = 42) -> Path:
+    """Write a synthetic N-Triples file of roughly `size_bytes` bytes. Reuses an existing file of the same size."""
+    if dest.exists() and dest.stat().st_size >= size_bytes:
+        return dest
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+    written = 0
+    with open(dest, "w", encoding="utf-8") as f:
+        while written < size_bytes:
+            lines = []
+            for _ in range(10_000):
+                if rng.random() < 0.3:
+                    obj = f'"literal value {rng.randrange(1_000_000)}"'
+                else:
+                    obj = _random_iri(rng)
+                lines.append(f"{_random_iri(rng)} {_random_predicate(rng)} {obj} .\n")
+            chunk = "".join(lines)
+            f.write(chunk)
+            written += len(chunk)
+    return dest
+
+
+def compress_zstd(source: Path, dest: Path) -> Path:
+    if dest.exists():
+        return dest
+    import zstandard as zstd
+    cctx = zstd.ZstdCompressor(level=3, threads=-1)
+    with open(source, "rb") as src, open(dest, "wb") as dst:
+        cctx.copy_stream(src, dst)
+    return dest
+
+
+# ---------------------------------------------------------------------------
+# benchmarks
+# ---------------------------------------------------------------------------
+
+def _time(fn: Callable[[], None], repeat: int, setup: Callable[[], None] = None) -> list[float]:
+    seconds = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def bench_translate(work_dir: Path, queries: int, repeat: int, **_) -> BenchmarkResult:
+    generated = generate_queries(queries)
+
+    def run():
+        for query in generated:
+            translate_to_simple_triple(query)
+
+    return BenchmarkResult("translate_to_simple_triple", "queries/s", queries, _time(run, repeat))
+
+
+def bench_process_sparql_file(work_dir: Path, queries: int, repeat: int, **_) -> BenchmarkResult:
+    source = work_dir.joinpath(f"queries-{queries}.txt")
+    if not source.exists():
+        source.write_text("\n".join(generate_queries(queries)) + "\n", encoding="utf-8")
+    output = work_dir.joinpath("queries-simplified.txt")
+    seconds = _time(lambda: process_sparql_file(source, output), repeat)
+    output.unlink(missing_ok=True)
+    return BenchmarkResult("process_sparql_file", "queries/s", queries, seconds)
+
+
+def bench_hash_file(work_dir: Path, file_mb: int, repeat: int, **_) -> BenchmarkResult:
+    source = generate_ntriples(work_dir.joinpath(f"dataset-{file_mb}M.nt"), file_mb * 2 ** 20)
+    # a first read warms the page cache, so the benchmark measures hashing and not the disk
+    util.hash_file(source)
+    seconds = _time(lambda: util.hash_file(source, "sha1"), repeat)
+    return BenchmarkResult("hash_file", "MiB/s", source.stat().st_size / 2 ** 20, seconds)
+
+
+def bench_extract_file(work_dir: Path, file_mb: int, repeat: int, **_) -> BenchmarkResult:
+    source = generate_ntriples(work_dir.joinpath(f"dataset-{file_mb}M.nt"), file_mb * 2 ** 20)
+    compressed = compress_zstd(source, work_dir.joinpath(f"dataset-{file_mb}M.nt.zst"))
+    dest = work_dir.joinpath("extracted.nt")
+    seconds = _time(lambda: util.extract_file(compressed, dest, util.CompressionAlgorithm.ZSTD, overwrite=True),
+                    repeat)
+    dest.unlink(missing_ok=True)
+    return BenchmarkResult("extract_file", "MiB/s", source.stat().st_size / 2 ** 20, seconds)
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def bench_download_file(work_dir: Path, file_mb: int, repeat: int, **_) -> BenchmarkResult:
+    source = generate_ntriples(work_dir.joinpath(f"dataset-{file_mb}M.nt"), file_mb * 2 ** 20)
+    checksum = int(util.hash_file(source, "sha1"), 16)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(_QuietHandler, directory=str(work_dir)))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    dest = work_dir.joinpath("downloaded.nt")
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/{source.name}"
+        seconds = _time(lambda: util.download_file(url, dest, checksum=checksum, checksum_type="sha1"), repeat,
+                        setup=lambda: dest.unlink(missing_ok=True))
+    finally:
+        server.shutdown()
+        server.server_close()
+        dest.unlink(missing_ok=True)
+    return BenchmarkResult("download_file", "MiB/s", source.stat().st_size / 2 ** 20, seconds)
+
+
+def bench_monitor_memory_usage(work_dir: Path, repeat: int, monitor_seconds: float = 2.0,
+                               monitor_interval: float = 0.01, **_) -> BenchmarkResult:
+    """
+    Measures the CPU time the monitoring thread spends per wall clock second of the monitored process. The
+    reported throughput is the inverse, i.e. monitored seconds per CPU second, so that higher is better.
+    """
+    cpu_seconds = []
+    for _ in range(repeat):
+        proc = subprocess.Popen(["sleep", f"{monitor_seconds}"])
+        start = time.thread_time()
+        util.monitor_memory_usage(proc, interval_seconds=monitor_interval)
+        cpu_seconds.append(time.thread_time() - start)
+    return BenchmarkResult(f"monitor_memory_usage@{monitor_interval}s", "monitored s/cpu s", monitor_seconds,
+                           cpu_seconds)
+
+
+def bench_footprint(work_dir: Path, repeat: int, **_) -> BenchmarkResult:
+    """
+    Analyzes a directory of many small files, like the index files of most stores. Also checks that a database
+    stored as a single file (like ITR's) is measured, instead of being skipped as an unreadable directory.
+    """
+    import footprint
+    single = generate_ntriples(work_dir.joinpath("footprint-single.nt"), 2 ** 20)
+    analyzed = footprint.analyze(single)
+    if (analyzed.files, analyzed.apparent_bytes) != (1, single.stat().st_size):
+        raise RuntimeError(f"analyze({single}) reported {analyzed.files} files and {analyzed.apparent_bytes} bytes, "
+                           f"expected 1 file and {single.stat().st_size} bytes")
+
+    tree = work_dir.joinpath("footprint-tree")
+    files = 0
+    for i in range(16):
+        directory = tree.joinpath(f"index-{i}")
+        directory.mkdir(parents=True, exist_ok=True)
+        for j in range(64):
+            directory.joinpath(f"part-{j}.idx").write_bytes(b"\0" * 4096)
+            files += 1
+    seconds = _time(lambda: footprint.analyze(tree), repeat)
+    return BenchmarkResult("footprint", "files/s", files, seconds)
+
+
+BENCHMARKS: dict[str, Callable[..., BenchmarkResult]] = {
+    "translate": bench_translate,
+    "process_sparql_file": bench_process_sparql_file,
+    "hash_file": bench_hash_file,
+    "extract_file": bench_extract_file,
+    "download_file": bench_download_file,
+    "monitor_memory_usage": bench_monitor_memory_usage,
+    "footprint": bench_footprint,
+}
+
+
+# ---------------------------------------------------------------------------
+# baselines
+# ---------------------------------------------------------------------------
+
+def results_to_json(results: list[BenchmarkResult], parameters: dict) -> dict:
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "machine": {
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "parameters": parameters,
+        "results": {r.name: {**asdict(r), "throughput": r.throughput} for r in results},
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list[tuple[str, float, float, float, bool]]:
+    """
+    Compare the throughputs of two result sets.
+    :return: tuples of (name, baseline throughput, current throughput, relative change, is regression)
+    """
+    rows = []
+    for name, result in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+        old = baseline["results"][name]["throughput"]
+        new = result["throughput"]
+        change = (new - old) / old if old else 0.0
+        rows.append((name, old, new, change, change < -tolerance))
+    return rows
+
+
+def print_results(results: list[BenchmarkResult], comparison: list | None = None) -> None:
+    from rich.console import Console
+    from rich.table import Table
+    table = Table(title="Harness micro-benchmarks")
+    table.add_column("benchmark")
+    table.add_column("median s", justify="right")
+    table.add_column("best s", justify="right")
+    table.add_column("throughput", justify="right")
+    if comparison is not None:
+        table.add_column("baseline", justify="right")
+        table.add_column("change", justify="right")
+    by_name = {row[0]: row for row in comparison or []}
+    for r in results:
+        row = [r.name, f"{r.median:.4f}", f"{r.best:.4f}", f"{r.throughput:,.1f} {r.unit}"]
+        if comparison is not None:
+            if r.name in by_name:
+                _, old, _, change, regression = by_name[r.name]
+                colour = "red" if regression else ("green" if change > 0 else "default")
+                row += [f"{old:,.1f}", f"[{colour}]{change:+.1%}[/{colour}]"]
+            else:
+                row += ["-", "-"]
+        table.add_row(*row)
+    Console().print(table)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the benchmark harness itself.")
+    parser.add_argument("benchmarks", nargs="*", default=list(BENCHMARKS),
+                        help=f"benchmarks to run, all by default ({', '.join(BENCHMARKS)})")
+    parser.add_argument("--work-dir", type=Path, default=Path("benchmarks/microbench"),
+                        help="directory for generated inputs, results and baselines")
+    parser.add_argument("--queries", type=int, default=100_000, help="number of generated queries")
+    parser.add_argument("--file-mb", type=int, default=256, help="size of generated files in MiB")
+    parser.add_argument("--repeat", type=int, default=5, help="repetitions per benchmark")
+    parser.add_argument("--baseline", type=Path, default=None,
+                        help="baseline file, defaults to <work-dir>/baseline.json")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--compare", action="store_true", help="compare this run against the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="relative throughput loss that is reported as regression")
+    parser.add_argument("--keep-inputs", action="store_true", help="don't delete generated inputs afterwards")
+    args = parser.parse_args()
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+
+    logging.basicConfig(level=logging.INFO)
+    work_dir: Path = args.work_dir
+    inputs_dir = work_dir.joinpath("inputs")
+    inputs_dir.mkdir(parents=True, exist_ok=True)
+    baseline_path: Path = args.baseline or work_dir.joinpath("baseline.json")
+    parameters = {"queries": args.queries, "file_mb": args.file_mb, "repeat": args.repeat}
+
+    results = []
+    for name in args.benchmarks:
+        logging.info(f"Running micro-benchmark {name}.")
+        results.append(BENCHMARKS[name](inputs_dir, **parameters))
+
+    run = results_to_json(results, parameters)
+    work_dir.joinpath(f"run_{run['timestamp'].replace(':', '-')}.json").write_text(json.dumps(run, indent=2))
+
+    comparison = None
+    if args.compare:
+        if not baseline_path.exists():
+            logging.error(f"No baseline found at {baseline_path}.")
+            sys.exit(2)
+        baseline = json.loads(baseline_path.read_text())
+        if baseline["parameters"] != parameters:
+            logging.warning(f"Baseline was recorded with different parameters: {baseline['parameters']}.")
+        comparison = compare(run, baseline, args.tolerance)
+
+    print_results(results, comparison)
+
+    if args.save_baseline:
+        baseline_path.write_text(json.dumps(run, indent=2))
+        logging.info(f"Stored baseline in {baseline_path}.")
+    if not args.keep_inputs:
+        shutil.rmtree(inputs_dir, ignore_errors=True)
+    if comparison is not None and any(row[4] for row in comparison):
+        sys.exit(1)
@@ -0,0 +1,299 @@
+"""
+Recording reverse proxy for SPARQL endpoints.
+
+The proxy is put between the benchmark client and `Triplestore.sparql_endpoint` and records per request the time
+to first byte (server evaluation) and the total transfer time (result serialization and streaming), the response
+size and the status. Records are appended to a compact binary log:
+
+    with RecordingProxy(triplestore.sparql_endpoint, Path("proxy.bin")) as proxy:
+        ...  # point the client to proxy.endpoint
+    print(summarize(read_records(Path("proxy.bin"))))
+"""
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import struct
+import threading
+import time
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from urllib.parse import urlsplit, urlunsplit
+
+MAGIC = b"RPXY\x01"
+# request start (unix µs), request forwarded, first response byte and last response byte (µs after the start),
+# response bytes, connection id, request number on the connection, status
+RECORD = struct.Struct("<QIIIQIIH")
+HEAD_LIMIT = 1 << 20
+
+
+@dataclass
+class ProxyRecord:
+    start_us: int
+    forwarded_us: int
+    ttfb_us: int
+    total_us: int
+    response_bytes: int
+    connection: int
+    request: int
+    status: int
+
+    @property
+    def server_us(self) -> int:
+        """Time the server took until the first byte of the response, after the request was forwarded."""
+        return self.ttfb_us - self.forwarded_us
+
+    @property
+    def transfer_us(self) -> int:
+        """Time from the first to the last byte of the response."""
+        return self.total_us - self.ttfb_us
+
+
+def _header(head: bytes, name: bytes) -> bytes | None:
+    for line in head.split(b"\r\n")[1:]:
+        key, _, value = line.partition(b":")
+        if key.strip().lower() == name:
+            return value.strip()
+    return None
+
+
+def _replace_header(head: bytes, name: bytes, value: bytes) -> bytes:
+    lines = head.split(b"\r\n")
+    for i, line in enumerate(lines[1:], start=1):
+        if line.partition(b":")[0].strip().lower() == name:
+            lines[i] = line.partition(b":")[0] + b": " + value
+    return b"\r\n".join(lines)
+
+
+async def _relay_body(head: bytes, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                      until_eof: bool) -> int:
+    """Relay a message body framed by Content-Length, chunked encoding or the end of the connection."""
+    relayed = 0
+    encoding = _header(head, b"transfer-encoding")
+    if encoding is not None and b"chunked" in encoding.lower():
+        while True:
+            size_line = await reader.readuntil(b"\r\n")
+            writer.write(size_line)
+            size = int(size_line.split(b";")[0].strip(), 16)
+            if size == 0:
+                # trailers, terminated by an empty line
+                while (line := await reader.readuntil(b"\r\n")) != b"\r\n":
+                    writer.write(line)
+                writer.write(line)
+                break
+            chunk = await reader.readexactly(size + 2)
+            writer.write(chunk)
+            relayed += size
+            await writer.drain()
+        return relayed
+
+    length = _header(head, b"content-length")
+    if length is not None:
+        remaining = int(length)
+        while remaining > 0:
+            chunk = await reader.read(min(remaining, 1 << 16))
+            if not chunk:
+                raise ConnectionError("connection closed before the end of the body")
+            writer.write(chunk)
+            relayed += len(chunk)
+            remaining -= len(chunk)
+            await writer.drain()
+    elif until_eof:
+        while chunk := await reader.read(1 << 16):
+            writer.write(chunk)
+            relayed += len(chunk)
+            await writer.drain()
+    return relayed
+
+
+class RecordingProxy:
+    """
+    :param upstream:    URL of the SPARQL endpoint, e.g. http://localhost:8080/
+    :param log_path:    Binary log the records are appended to
+    :param port:        Local port, 0 picks a free one
+    """
+
+    def __init__(self, upstream: str, log_path: Path, port: int = 0) -> None:
+        parts = urlsplit(upstream)
+        self.upstream = upstream
+        self.upstream_host = parts.hostname
+        self.upstream_port = parts.port or 80
+        self.upstream_path = parts.path or "/"
+        # some stores depend on the Host header, e.g. Virtuoso chooses the default graph by it
+        self.upstream_netloc = parts.netloc.encode()
+        self.log_path = log_path
+        self.port = port
+        self.records = 0
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._server: asyncio.Server | None = None
+        self._stopping: asyncio.Event | None = None
+        self._thread: threading.Thread | None = None
+        self._ready = threading.Event()
+        self._connections = 0
+        self._log = None
+
+    @property
+    def endpoint(self) -> str:
+        return urlunsplit(("http", f"127.0.0.1:{self.port}", self.upstream_path, "", ""))
+
+    def _record(self, record: ProxyRecord) -> None:
+        self._log.write(RECORD.pack(*asdict(record).values()))
+        self.records += 1
+
+    async def _handle(self, client_reader: asyncio.StreamReader, client_writer: asyncio.StreamWriter) -> None:
+        self._connections += 1
+        connection = self._connections
+        upstream_reader = upstream_writer = None
+        request_number = 0
+        try:
+            while True:
+                try:
+                    request_head = await client_reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                start_ns = time.perf_counter_ns()
+                start_us = time.time_ns() // 1000
+                request_number += 1
+
+                if upstream_writer is None or upstream_writer.is_closing():
+                    upstream_reader, upstream_writer = await asyncio.open_connection(
+                        self.upstream_host, self.upstream_port, limit=HEAD_LIMIT)
+                upstream_writer.write(_replace_header(request_head, b"host", self.upstream_netloc))
+                await _relay_body(request_head, client_reader, upstream_writer, until_eof=False)
+                await upstream_writer.drain()
+                forwarded_ns = time.perf_counter_ns()
+
+                first = await upstream_reader.read(1)
+                ttfb_ns = time.perf_counter_ns()
+                if not first:
+                    break
+                response_head = first + await upstream_reader.readuntil(b"\r\n\r\n")
+                client_writer.write(response_head)
+                status = int(response_head.split(b" ", 2)[1])
+                method = request_head.split(b" ", 1)[0]
+                connection_header = (_header(response_head, b"connection") or b"").lower()
+                http10 = response_head.startswith(b"HTTP/1.0")
+                close = connection_header == b"close" or (http10 and connection_header != b"keep-alive")
+                body = 0
+                if method != b"HEAD" and status >= 200 and status not in (204, 304):
+                    body = await _relay_body(response_head, upstream_reader, client_writer, until_eof=close)
+                await client_writer.drain()
+                end_ns = time.perf_counter_ns()
+
+                self._record(ProxyRecord(start_us, (forwarded_ns - start_ns) // 1000, (ttfb_ns - start_ns) // 1000,
+                                         (end_ns - start_ns) // 1000, len(response_head) + body, connection,
+                                         request_number, status))
+                if close:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError) as e:
+            logging.debug(f"Proxy connection {connection} failed: {e!r}")
+        finally:
+            for writer in (client_writer, upstream_writer):
+                if writer is not None:
+                    writer.close()
+
+    async def _serve(self) -> None:
+        self._stopping = asyncio.Event()
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", self.port, limit=HEAD_LIMIT)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        # not serve_forever(), its cancellation waits until all keep-alive connections were closed by the clients
+        await self._stopping.wait()
+        self._server.close()
+        # cancel the handlers of open connections and let them finish before the loop is closed
+        handlers = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in handlers:
+            task.cancel()
+        await asyncio.gather(*handlers, return_exceptions=True)
+
+    def start(self) -> "RecordingProxy":
+        """Start the proxy in a background thread with its own event loop."""
+        self.log_path.parent.mkdir(parents=True, exist_ok=True)
+        new_log = not self.log_path.exists() or self.log_path.stat().st_size == 0
+        self._log = open(self.log_path, "ab", buffering=1 << 16)
+        if new_log:
+            self._log.write(MAGIC)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_until_complete, args=(self._serve(),),
+                                        name="recording-proxy", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        logging.info(f"Recording proxy for {self.upstream} listening on {self.endpoint}.")
+        return self
+
+    def stop(self) -> None:
+        if self._stopping is not None:
+            self._loop.call_soon_threadsafe(self._stopping.set)
+        if self._thread is not None:
+            self._thread.join()
+            self._loop.close()
+        if self._log is not None:
+            self._log.close()
+        logging.info(f"Recording proxy stopped, {self.records} requests recorded in {self.log_path}.")
+
+    def __enter__(self) -> "RecordingProxy":
+        return self.start()
+
+    def __exit__(self, *_) -> None:
+        self.stop()
+
+
+def read_records(path: Path) -> list[ProxyRecord]:
+    data = path.read_bytes()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path} is not a recording proxy log")
+    body = memoryview(data)[len(MAGIC):]
+    usable = len(body) - len(body) % RECORD.size  # ignore a partially written last record
+    return [ProxyRecord(*values) for values in RECORD.iter_unpack(body[:usable])]
+
+
+def summarize(records: list[ProxyRecord]) -> dict:
+    if not records:
+        return {"requests": 0}
+
+    def quantiles(values: list[int]) -> dict:
+        values = sorted(values)
+        return {
+            "mean": statistics.fmean(values),
+            "p50": values[len(values) // 2],
+            "p99": values[min(len(values) - 1, int(len(values) * 0.99))],
+            "max": values[-1],
+        }
+
+    statuses: dict[int, int] = {}
+    for record in records:
+        statuses[record.status] = statuses.get(record.status, 0) + 1
+    server = sum(r.server_us for r in records)
+    transfer = sum(r.transfer_us for r in records)
+    return {
+        "requests": len(records),
+        "statuses": statuses,
+        "server_us": quantiles([r.server_us for r in records]),
+        "transfer_us": quantiles([r.transfer_us for r in records]),
+        "response_bytes": quantiles([r.response_bytes for r in records]),
+        # share of the time after forwarding the request that was spent on transferring the response
+        "transfer_share": transfer / (server + transfer) if server + transfer else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recording reverse proxy for SPARQL endpoints.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="run the proxy until interrupted")
+    serve.add_argument("upstream", help="endpoint URL, e.g. http://localhost:8080/")
+    serve.add_argument("log", type=Path, help="binary log file")
+    serve.add_argument("--port", type=int, default=0)
+    summary = commands.add_parser("summary", help="summarize a binary log")
+    summary.add_argument("log", type=Path)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "serve":
+        with RecordingProxy(args.upstream, args.log, args.port):
+            try:
+                threading.Event().wait()
+            except KeyboardInterrupt:
+                pass
+    else:
+        print(json.dumps(summarize(read_records(args.log)), indent=2))
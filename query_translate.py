@@ -1,5 +1,8 @@
 import re
 
+import tracing
+
+
 def translate_to_simple_triple(query):
     triple_pattern = re.search(r'\{\s*(.*?)\s*\}', query, re.DOTALL)
     if not triple_pattern:
@@ -38,9 +41,11 @@ def translate_to_simple_triple(query):
 
     return f"SELECT {variables} WHERE {{ {subject} {predicate} {obj} . }}"
 
+@tracing.traced("translate")
 def process_sparql_file(file_path, output_path):
     with open(file_path, 'r') as file:
         queries = file.readlines()
+    tracing.set_attributes(source=str(file_path), queries=len(queries))
 
     with open(output_path, 'w') as output_file:
         for query in queries:
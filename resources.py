@@ -0,0 +1,86 @@
+"""
+Declarative resource envelopes for triplestore processes: CPU affinity, thread count and memory limit.
+"""
+import os
+from dataclasses import dataclass
+
+from global_params import ram_limit_g
+
+
+def available_cpus() -> list[int]:
+    return sorted(os.sched_getaffinity(0))
+
+
+def physical_memory_g() -> float:
+    import psutil
+    return psutil.virtual_memory().total / 1024 ** 3
+
+
+@dataclass
+class ResourceEnvelope:
+    cpus: frozenset[int] | None = None  # CPU affinity set, None for all CPUs the harness may use
+    threads: int | None = None  # worker threads, None to use the store's default
+    memory_limit_g: int | None = None  # memory limit in gigabytes, None for `ram_limit_g`
+
+    @staticmethod
+    def for_cores(cores: int, memory_limit_g: int | None = None) -> "ResourceEnvelope":
+        """Envelope pinned to the first `cores` available CPUs, with one thread per core."""
+        cpus = available_cpus()
+        if cores > len(cpus):
+            raise ValueError(f"Requested {cores} cores, but only {len(cpus)} are available.")
+        return ResourceEnvelope(frozenset(cpus[:cores]), cores, memory_limit_g)
+
+    @property
+    def cpu_count(self) -> int:
+        return len(self.cpus) if self.cpus is not None else len(available_cpus())
+
+    @property
+    def thread_count(self) -> int:
+        return self.threads if self.threads is not None else self.cpu_count
+
+    @property
+    def memory_g(self) -> int:
+        return self.memory_limit_g if self.memory_limit_g is not None else ram_limit_g
+
+    @property
+    def usable_memory_g(self) -> float:
+        """The memory limit, capped by the memory the machine actually has."""
+        return min(self.memory_g, physical_memory_g())
+
+    def command(self, args: list, limit_address_space: bool = True) -> list:
+        """
+        Wrap a command with `taskset` and `prlimit`, which apply the envelope before executing it, so the limits are
+        inherited by all processes the command starts. Unlike `Popen(preexec_fn=...)` this is safe while the harness
+        runs threads (e.g. the load and footprint monitors).
+        :param limit_address_space: Enforce the memory limit with RLIMIT_AS. Disable it for the JVM, which reserves
+                                    far more virtual memory than it uses, and use `jvm_options` instead.
+        """
+        prefix = []
+        if self.cpus is not None:
+            prefix += ["taskset", "--cpu-list", ",".join(str(cpu) for cpu in sorted(self.cpus))]
+        if self.memory_limit_g is not None and limit_address_space:
+            prefix += ["prlimit", f"--as={self.memory_limit_g * 1024 ** 3}", "--"]
+        return prefix + list(args)
+
+    def environment(self, base: dict[str, str] | None = None) -> dict[str, str]:
+        """Environment for the child, limiting OpenMP thread pools to the thread count."""
+        env = dict(os.environ if base is None else base)
+        if self.threads is not None:
+            env["OMP_NUM_THREADS"] = str(self.threads)
+        return env
+
+    def jvm_options(self, heap_g: int | None = None) -> str:
+        """
+        :param heap_g:  Maximum heap size, defaults to the memory limit
+        """
+        options = f"-Xms1g -Xmx{heap_g if heap_g is not None else self.memory_g}g"
+        if self.cpus is not None or self.threads is not None:
+            options += f" -XX:ActiveProcessorCount={self.thread_count}"
+        return options
+
+    def describe(self) -> dict:
+        return {
+            "cpus": sorted(self.cpus) if self.cpus is not None else None,
+            "threads": self.threads,
+            "memory_limit_g": self.memory_limit_g,
+        }
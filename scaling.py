@@ -0,0 +1,108 @@
+"""
+Scaling sweep: reruns the load and query phases of a triplestore across core counts and memory caps and reports
+speedup and parallel efficiency relative to the smallest core count.
+"""
+import csv
+import json
+import logging
+from dataclasses import dataclass, asdict
+from pathlib import Path
+
+import tracing
+from dataset import Dataset
+from iguana import Iguana
+from resources import ResourceEnvelope, available_cpus
+from triplestore import Triplestore
+
+
+@dataclass
+class ScalingPoint:
+    cores: int
+    memory_limit_g: int | None
+    load_s: float | None = None
+    measure_s: float | None = None
+    load_speedup: float | None = None
+    load_efficiency: float | None = None
+    measure_speedup: float | None = None
+    measure_efficiency: float | None = None
+    error: str = ""
+
+
+def _add_speedups(points: list[ScalingPoint]) -> None:
+    """Speedup and efficiency relative to the smallest core count with the same memory cap."""
+    for memory_limit_g in {p.memory_limit_g for p in points}:
+        series = sorted((p for p in points if p.memory_limit_g == memory_limit_g and not p.error),
+                        key=lambda p: p.cores)
+        if not series:
+            continue
+        reference = series[0]
+        for point in series:
+            if reference.load_s and point.load_s:
+                point.load_speedup = reference.load_s / point.load_s
+                point.load_efficiency = point.load_speedup * reference.cores / point.cores
+            if reference.measure_s and point.measure_s:
+                point.measure_speedup = reference.measure_s / point.measure_s
+                point.measure_efficiency = point.measure_speedup * reference.cores / point.cores
+
+
+def scaling_sweep(triplestore: Triplestore, dataset: Dataset, iguana: Iguana, substitution_map: dict,
+                  suites_dir: Path, results_dir: Path, cores: list[int],
+                  memory_limits_g: list[int | None] = (None,)) -> list[ScalingPoint]:
+    """
+    Load the dataset and run the benchmark once per combination of core count and memory cap. The database is
+    deleted before every load, so the loads are comparable.
+    :param substitution_map:    Template values for the iguana configuration, the result directory is adjusted per run
+    :param results_dir:         Directory for the iguana results of every run and the sweep report
+    :param cores:               Core counts, e.g. [1, 2, 4, 8], counts above the available CPUs are skipped
+    :param memory_limits_g:     Memory caps in gigabytes, None for `ram_limit_g`
+    """
+    available = len(available_cpus())
+    if skipped := [c for c in cores if c > available]:
+        logging.warning(f"Skipping core counts {skipped} of the scaling sweep, only {available} CPUs are available.")
+        cores = [c for c in cores if c <= available]
+    original_envelope = triplestore.envelope
+    points = []
+    try:
+        for memory_limit_g in memory_limits_g:
+            for core_count in cores:
+                point = ScalingPoint(core_count, memory_limit_g)
+                points.append(point)
+                name = f"{triplestore.name}-{dataset.name}-c{core_count}-m{memory_limit_g or 'max'}"
+                logging.info(f"Scaling sweep {name}.")
+                with tracing.span("scaling-point", name=name, cores=core_count, memory_limit_g=memory_limit_g):
+                    try:
+                        triplestore.envelope = ResourceEnvelope.for_cores(core_count, memory_limit_g)
+                        triplestore.delete_database(dataset)
+                        triplestore.load(dataset)
+                        point.load_s = triplestore.load_ns / 1e9
+
+                        configuration = iguana.instantiate_template(
+                            name, suites_dir, **{**substitution_map, "result_directory": results_dir.joinpath(name)})
+                        point.measure_s = iguana.run_benchmark(triplestore, dataset, configuration)
+                    except Exception as e:
+                        logging.exception(f"Scaling sweep {name} failed.")
+                        point.error = repr(e)
+    finally:
+        triplestore.envelope = original_envelope
+        _add_speedups(points)
+        write_report(points, results_dir.joinpath(f"scaling-{triplestore.name}-{dataset.name}"))
+    return points
+
+
+def write_report(points: list[ScalingPoint], path: Path) -> None:
+    """Write the sweep as `<path>.csv` and `<path>.json`."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path.with_suffix(".csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(ScalingPoint.__dataclass_fields__))
+        writer.writeheader()
+        for point in points:
+            writer.writerow(asdict(point))
+    path.with_suffix(".json").write_text(json.dumps([asdict(p) for p in points], indent=2))
+    for point in points:
+        if point.error:
+            logging.info(f"cores={point.cores} memory={point.memory_limit_g}: failed ({point.error})")
+        else:
+            logging.info(f"cores={point.cores} memory={point.memory_limit_g}: load {point.load_s:.1f}s "
+                         f"(speedup {point.load_speedup or 0:.2f}, efficiency {point.load_efficiency or 0:.0%}), "
+                         f"queries {point.measure_s or 0:.1f}s (speedup {point.measure_speedup or 0:.2f}, "
+                         f"efficiency {point.measure_efficiency or 0:.0%})")
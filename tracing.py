@@ -0,0 +1,186 @@
+"""
+Lightweight span tracing for the benchmark harness.
+
+Spans are nested, timestamped intervals with attributes and resource counters. A trace can be exported as
+Chrome-trace JSON (open it in https://ui.perfetto.dev or chrome://tracing) together with a compact summary:
+
+    with tracing.span("load", triplestore="itr", dataset="swdf") as s:
+        ...
+        s.set(bytes=1234)
+    tracing.tracer.export(Path("benchmarks/logs/traces"), "run")
+"""
+import json
+import logging
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from dataclasses import dataclass, field
+from pathlib import Path
+
+
+def _resource_counters() -> dict[str, float]:
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    counters = {
+        "cpu_user_s": own.ru_utime,
+        "cpu_sys_s": own.ru_stime,
+        # only contains children that have already been waited for, e.g. a finished loader process
+        "children_cpu_user_s": children.ru_utime,
+        "children_cpu_sys_s": children.ru_stime,
+    }
+    try:
+        import psutil
+        io = psutil.Process().io_counters()
+        counters["read_bytes"] = io.read_bytes
+        counters["write_bytes"] = io.write_bytes
+    except Exception:
+        pass
+    return counters
+
+
+@dataclass
+class Span:
+    name: str
+    category: str
+    start_ns: int
+    thread_id: int
+    parent: "Span | None" = None
+    end_ns: int | None = None
+    attributes: dict = field(default_factory=dict)
+    counters: dict = field(default_factory=dict)
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    @property
+    def path(self) -> str:
+        return self.name if self.parent is None else f"{self.parent.path}/{self.name}"
+
+    @property
+    def duration_ns(self) -> int:
+        return (self.end_ns if self.end_ns is not None else time.perf_counter_ns()) - self.start_ns
+
+
+class Tracer:
+    def __init__(self) -> None:
+        self.spans: list[Span] = []
+        self.origin_ns: int = time.perf_counter_ns()
+        self.origin_wall_ns: int = time.time_ns()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self) -> list[Span]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def current_span(self) -> Span | None:
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    @contextmanager
+    def span(self, name: str, category: str = "harness", **attributes):
+        """
+        Record a span around the body of the with statement. Spans opened inside the body become children.
+        :param name:        Phase name, e.g. download, decompress, translate, load, start, ready, warmup, measure, stop
+        :param category:    Chrome-trace category
+        :param attributes:  Arbitrary JSON serializable attributes
+        """
+        stack = self._stack()
+        span = Span(name, category, time.perf_counter_ns(), threading.get_ident(),
+                    parent=stack[-1] if stack else None, attributes=dict(attributes))
+        before = _resource_counters()
+        with self._lock:
+            self.spans.append(span)
+        stack.append(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.set(error=repr(e))
+            raise
+        finally:
+            stack.pop()
+            span.end_ns = time.perf_counter_ns()
+            after = _resource_counters()
+            span.counters = {key: after[key] - before[key] for key in after if key in before}
+            logging.debug(f"span {span.path} took {span.duration_ns / 1e9:.3f}s")
+
+    def chrome_trace(self) -> dict:
+        pid = os.getpid()
+        events = [{"name": "process_name", "ph": "M", "pid": pid, "args": {"name": "benchmark harness"}}]
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            events.append({
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                "ts": (span.start_ns - self.origin_ns) / 1000,
+                "dur": span.duration_ns / 1000,
+                "pid": pid,
+                "tid": span.thread_id,
+                "args": {**span.attributes, **span.counters},
+            })
+        return {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "otherData": {"origin_unix_ns": self.origin_wall_ns},
+        }
+
+    def summary(self) -> dict:
+        """Aggregate spans by their path, e.g. run/benchmark/load."""
+        paths: dict[str, dict] = {}
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            seconds = span.duration_ns / 1e9
+            entry = paths.setdefault(span.path, {"count": 0, "total_s": 0.0, "min_s": seconds, "max_s": seconds})
+            entry["count"] += 1
+            entry["total_s"] += seconds
+            entry["min_s"] = min(entry["min_s"], seconds)
+            entry["max_s"] = max(entry["max_s"], seconds)
+        wall = (time.perf_counter_ns() - self.origin_ns) / 1e9
+        for entry in paths.values():
+            entry["share"] = entry["total_s"] / wall if wall > 0 else 0.0
+        return {"wall_s": wall, "spans": dict(sorted(paths.items(), key=lambda item: -item[1]["total_s"]))}
+
+    def export(self, directory: Path, name: str) -> Path:
+        """Write `<name>.trace.json` (Chrome-trace) and `<name>.summary.json` into the directory."""
+        directory.mkdir(parents=True, exist_ok=True)
+        trace_path = directory.joinpath(f"{name}.trace.json")
+        trace_path.write_text(json.dumps(self.chrome_trace()))
+        directory.joinpath(f"{name}.summary.json").write_text(json.dumps(self.summary(), indent=2))
+        return trace_path
+
+
+# process wide default tracer used by the harness
+tracer = Tracer()
+
+
+def span(name: str, category: str = "harness", **attributes):
+    return tracer.span(name, category, **attributes)
+
+
+def current_span() -> Span | None:
+    return tracer.current_span()
+
+
+def set_attributes(**attributes) -> None:
+    """Set attributes on the innermost open span of the calling thread, if there is one."""
+    span = tracer.current_span()
+    if span is not None:
+        span.set(**attributes)
+
+
+def traced(name: str, category: str = "harness"):
+    """Decorator recording a span around every call of the decorated function."""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name, category, function=function.__qualname__):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
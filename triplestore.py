@@ -1,17 +1,20 @@
 import datetime
 import shutil
 import subprocess
-import os
 import time
+from contextlib import contextmanager
 from dataclasses import dataclass
 from pathlib import Path
 from datetime import datetime
 from subprocess import Popen
 import logging
 
+import footprint
+import tracing
 import util
 from dataset import Dataset
-from global_params import ram_limit_g
+from load_monitor import LoadAbortedError, LoadFailedError, LoadProgressMonitor
+from resources import ResourceEnvelope
 from util import bash
 
 
@@ -34,6 +37,15 @@ class Triplestore:
         self.database_dir.mkdir(parents=True, exist_ok=True)
 
         self.logs_dir: Path = base_dir.joinpath("logs")
+        # abort loads whose projected duration exceeds this many seconds, None to never abort
+        self.max_load_seconds: int | None = None
+        self.load_progress: LoadProgressMonitor | None = None
+        self.load_ns: int | None = None  # duration of the last load, without the statistics written afterwards
+        # CPU affinity, thread count and memory limit applied to the loader and the server
+        self.envelope: ResourceEnvelope = ResourceEnvelope()
+        # derive loader and server settings from the dataset and the envelope, see `tune`
+        self.auto_tune: bool = False
+        self.tuning: dict = {}
 
     def _load_impl(self, dataset: Dataset) -> tuple[DatabaseVersion, int]:
         raise NotImplemented()
@@ -41,25 +53,137 @@ class Triplestore:
     def start(self, db_version: DatabaseVersion) -> Popen[bytes]:
         raise NotImplemented()
 
+    def tune(self, dataset: Dataset) -> dict:
+        """
+        Derive loader and server settings for the dataset from its statistics and the resource envelope. Settings
+        that are missing from the result keep their defaults.
+        """
+        return {}
+
+    def _apply_tuning(self, dataset: Dataset) -> None:
+        self.tuning = self.tune(dataset) if self.auto_tune else {}
+        if self.tuning:
+            logging.info(f"Tuned {self.name} for {dataset.name}: {self.tuning}")
+
     def load(self, dataset: Dataset) -> DatabaseVersion:
         import time
-        elapsed = time.perf_counter_ns()
-        db_version, mem_usage = self._load_impl(dataset)
-        elapsed = time.perf_counter_ns() - elapsed
+        dataset.triple_count()  # count the triples for the progress monitor before the time is taken
+        self._apply_tuning(dataset)
+        self.load_progress = None
+        self.load_ns = None
+        growth = footprint.FootprintMonitor(self.dataset_db_dir(dataset))
+        with tracing.span("load", triplestore=self.name, dataset=dataset.name) as span:
+            growth.start()
+            try:
+                elapsed = time.perf_counter_ns()
+                db_version, mem_usage = self._load_impl(dataset)
+                elapsed = time.perf_counter_ns() - elapsed
+            except LoadFailedError:
+                # a partial database would be taken for a loaded one by the next run
+                logging.info(f"Deleting the partially loaded {dataset.name} database of {self.name}.")
+                self.delete_database(dataset)
+                raise
+            finally:
+                growth.stop()
+            self.load_ns = elapsed
+            span.set(rss=mem_usage)
 
         try:
             # write elapsed time and memory footprint to file
             import json
+            logs_dir = self.database_logs_dir(db_version)
+            logs_dir.mkdir(parents=True, exist_ok=True)
+            db_footprint = footprint.analyze(self.dataset_db_dir(dataset))
+            (logs_dir.joinpath("footprint.json")
+            .write_text(json.dumps(db_footprint.to_json(dataset.triple_count()), indent=2)))
+            growth.write_csv(logs_dir.joinpath("footprint_growth.csv"))
+            stats = {
+                "ns": elapsed,
+                "bytes": db_footprint.apparent_bytes,
+                "allocated_bytes": db_footprint.allocated_bytes,
+                "peak_bytes": max(growth.peak_bytes(), db_footprint.apparent_bytes),
+                "bits_per_triple": db_footprint.bits_per_triple(dataset.triple_count()),
+                "rss": mem_usage,
+                "envelope": self.envelope.describe(),
+            }
+            if self.load_progress is not None:
+                stats["progress"] = self.load_progress.summary()
             (self.database_logs_dir(db_version)
             .joinpath("loading_stats.json")
-            .write_text(json.dumps({
-                "ns": elapsed,
-                "bytes": bash(f"du -bs '{self.dataset_db_dir(dataset).absolute()}'").split("\t")[0],
-                "rss": mem_usage
-            })))
+            .write_text(json.dumps(stats)))
+            if self.tuning:
+                (self.database_logs_dir(db_version)
+                .joinpath("tuning.json")
+                .write_text(json.dumps({
+                    "settings": self.tuning,
+                    "dataset": {"triples": dataset.triple_count(), "distinct_terms": dataset.distinct_terms()},
+                    "envelope": self.envelope.describe(),
+                    "cores": self.envelope.cpu_count,
+                    "usable_memory_g": self.envelope.usable_memory_g,
+                }, indent=2)))
         finally:
             return db_version
 
+    def ensure_loaded(self, dataset: Dataset) -> DatabaseVersion:
+        """Load the dataset unless a database for it exists already."""
+        if not self.is_database_loaded(dataset):
+            logging.info(f"The {dataset.name} dataset hasn't been loaded into {self.name} yet. Loading now.")
+            db_version = self.load(dataset)
+            logging.info(f"Loaded {dataset.name} dataset into {self.name}.")
+            return db_version
+        self._apply_tuning(dataset)  # the server settings depend on the tuning as well
+        return DatabaseVersion.for_dataset(dataset)
+
+    @contextmanager
+    def running(self, db_version: DatabaseVersion):
+        """
+        Start the server, wait until its endpoint is available and stop it again when the with statement is left.
+        :param db_version:  The database version to serve
+        :return:            The handle to the server process
+        """
+        logging.info(f"Starting {self.name}.")
+        with tracing.span("start", triplestore=self.name):
+            handle = self.start(db_version)
+        assert handle.poll() is None
+        try:
+            logging.info(f"Waiting for {self.name} to initialize")
+            with tracing.span("ready", endpoint=self.sparql_endpoint):
+                util.wait_until_available(self.sparql_endpoint, timeout=20 * 60)  # up to 20 minutes
+            logging.info(f"Started {self.name}.")
+            yield handle
+        finally:
+            logging.info(f"Stopping {self.name}.")
+            self.stop(handle)
+            assert handle.poll() is not None
+
+    def _monitor_load(self, proc: Popen, dataset: Dataset, db_version: DatabaseVersion,
+                      input_path: Path | None = None, check: bool = True) -> int:
+        """
+        Monitor the memory usage and the input read progress of a loader process until it exits. The throughput
+        curve is written to `load_progress.csv` in the logs directory of the database version.
+        :param proc:        The process reading the dataset
+        :param input_path:  The file the process reads, defaults to the dataset file
+        :param check:       Raise `LoadFailedError` if the process exits with a non-zero status
+        :return:            The highest observed rss
+        """
+        monitor = LoadProgressMonitor(proc, input_path or dataset.dataset_path, dataset.triple_count(),
+                                      max_load_seconds=self.max_load_seconds)
+        monitor.start()
+        try:
+            mem = util.monitor_memory_usage(proc)
+        finally:
+            monitor.join()
+            monitor.write_csv(self.database_logs_dir(db_version).joinpath("load_progress.csv"))
+            self.load_progress = monitor
+        if monitor.aborted:
+            raise LoadAbortedError(f"Loading {dataset.name} into {self.name} was aborted, "
+                               f"it would have taken longer than {self.max_load_seconds}s.")
+        if check and proc.wait() != 0:
+            raise LoadFailedError(f"Loading {dataset.name} into {self.name} failed, "
+                                  f"the loader exited with status {proc.returncode}.")
+        return mem
+
+    @tracing.traced("stop")
     def stop(self, handle: Popen[bytes]):
         handle.terminate()  # TODO: SIGINT maybe, because of tentris?
         for i in range(30):  # wait up to 30 seconds
@@ -109,27 +233,34 @@ class Tentris(Triplestore):
         db_version = DatabaseVersion.for_dataset(dataset)
         log_dir = self.database_logs_dir(db_version)
 
-        proc = subprocess.Popen([f"{self.installation_dir.absolute()}/tentris_loader",
-                                 "--file", f"{dataset.dataset_path}",
-                                 "--storage", db_dir,
-                                 "--logfiledir",
-                                 f"{log_dir.absolute()}",
-                                 "--loglevel", "trace"])
-        mem = util.monitor_memory_usage(proc)
+        proc = subprocess.Popen(self.envelope.command([f"{self.installation_dir.absolute()}/tentris_loader",
+                                                       "--file", f"{dataset.dataset_path}",
+                                                       "--storage", db_dir,
+                                                       "--logfiledir",
+                                                       f"{log_dir.absolute()}",
+                                                       "--loglevel", "trace"]),
+                                env=self.envelope.environment())
+        mem = self._monitor_load(proc, dataset, db_version)
         return db_version, mem
 
+    def tune(self, dataset: Dataset) -> dict:
+        # the server evaluates queries in parallel, one thread per core
+        return {"threads": self.envelope.thread_count}
+
     def start(self, db_version: DatabaseVersion) -> Popen[bytes]:
         """
         Start the server in the background and return the handle
         :param db_version:  The database version to start
         :return:          The handle to the process
         """
-        return subprocess.Popen([f"{self.installation_dir.absolute()}/tentris_server",
-                                 "-j", f"{1}",
-                                 "--storage", self.dataset_db_dir(db_version.dataset),
-                                 "--logfiledir",
-                                 f"{self.database_logs_dir(db_version)}/",
-                                 "--loglevel", "info"])
+        threads = self.tuning.get('threads', self.envelope.threads or 1)
+        return subprocess.Popen(self.envelope.command([f"{self.installation_dir.absolute()}/tentris_server",
+                                                       "-j", f"{threads}",
+                                                       "--storage", self.dataset_db_dir(db_version.dataset),
+                                                       "--logfiledir",
+                                                       f"{self.database_logs_dir(db_version)}/",
+                                                       "--loglevel", "info"]),
+                                env=self.envelope.environment())
 
 
 class Oxigraph(Triplestore):
@@ -155,18 +286,20 @@ class Oxigraph(Triplestore):
         log_dir.mkdir(parents=True, exist_ok=True)
 
         with open(log_dir.joinpath("loading.log"), "w") as f:
-            proc = subprocess.Popen([f"{self.executable_path}",
-                                     "load",
-                                     "--file", f"{dataset.dataset_path}",
-                                     "--location", db_dir,
-                                     "--lenient"], stdout=f, stderr=subprocess.STDOUT)
-            mem = util.monitor_memory_usage(proc)
+            proc = subprocess.Popen(self.envelope.command([f"{self.executable_path}",
+                                                           "load",
+                                                           "--file", f"{dataset.dataset_path}",
+                                                           "--location", db_dir,
+                                                           "--lenient"]), stdout=f, stderr=subprocess.STDOUT,
+                                    env=self.envelope.environment())
+            mem = self._monitor_load(proc, dataset, db_version)
         return db_version, mem
 
     def start(self, db_version: DatabaseVersion) -> Popen[bytes]:
-        return subprocess.Popen([f"{self.executable_path}",
-                                 "serve",
-                                 "--location", str(self.dataset_db_dir(db_version.dataset))])  # TODO: log
+        return subprocess.Popen(self.envelope.command([f"{self.executable_path}",
+                                                       "serve",
+                                                       "--location", str(self.dataset_db_dir(db_version.dataset))]),
+                                env=self.envelope.environment())  # TODO: log
 
 
 class Fuseki(Triplestore):
@@ -204,28 +337,45 @@ class Fuseki(Triplestore):
         log_dir = self.database_logs_dir(db_version)
         log_dir.mkdir(parents=True, exist_ok=True)
 
-        env_opts = os.environ.copy()
-        env_opts['JAVA_OPTS'] = f'-Xms1g -Xmx{ram_limit_g}g'
+        env_opts = self.envelope.environment()
+        env_opts['JAVA_OPTS'] = self.envelope.jvm_options(self.tuning.get("loader_heap_g"))
+        loader_options = [f"--loader={self.tuning['loader']}"] if "loader" in self.tuning else []
 
         with open(log_dir.joinpath("loading.log"), "w") as f:
-            r = subprocess.Popen([f"{self.jena_dir}/bin/tdb2.tdbloader",
-                                  "--loc", f"{db_dir}",
-                                  f"{dataset.dataset_path}", ],
+            r = subprocess.Popen(self.envelope.command([f"{self.jena_dir}/bin/tdb2.tdbloader",
+                                                        *loader_options,
+                                                        "--loc", f"{db_dir}",
+                                                        f"{dataset.dataset_path}", ], limit_address_space=False),
                                  stdout=f, stderr=subprocess.STDOUT,
                                  env=env_opts)
-            mem = util.monitor_memory_usage(r)
-            assert r.returncode == 0
+            mem = self._monitor_load(r, dataset, db_version)
 
         return db_version, mem
 
+    def tune(self, dataset: Dataset) -> dict:
+        import math
+        cores = self.envelope.cpu_count
+        memory_g = self.envelope.usable_memory_g
+        # TDB2 keeps its indexes in memory mapped files outside the heap, so the heap only needs to hold the node
+        # cache and the loader's buffers (roughly 200 bytes per distinct term); the rest is left to the page cache
+        heap_g = max(2, math.ceil(dataset.distinct_terms() * 200 / 1024 ** 3) + 2)
+        heap_g = int(min(heap_g, max(1, memory_g // 2)))
+        if cores >= 4 and memory_g >= 16:
+            loader = "parallel"  # uses several threads per index, needs cores and memory
+        elif memory_g >= 8:
+            loader = "phased"
+        else:
+            loader = "light"
+        return {"loader": loader, "loader_heap_g": heap_g, "server_heap_g": min(heap_g, max(1, int(memory_g // 4)))}
+
     def start(self, db_version: DatabaseVersion) -> Popen[bytes]:
-        env_opts = os.environ.copy()
-        env_opts['JAVA_OPTS'] = f'-Xms1g -Xmx{ram_limit_g}g'
+        env_opts = self.envelope.environment()
+        env_opts['JAVA_OPTS'] = self.envelope.jvm_options(self.tuning.get("server_heap_g"))
 
-        return subprocess.Popen(["java", "-jar", "fuseki-server.jar",
-                                 f"--loc={self.dataset_db_dir(db_version.dataset).absolute()}",
-                                 "--update",
-                                 "/ds"],
+        return subprocess.Popen(self.envelope.command(["java", "-jar", "fuseki-server.jar",
+                                                       f"--loc={self.dataset_db_dir(db_version.dataset).absolute()}",
+                                                       "--update",
+                                                       "/ds"], limit_address_space=False),
                                 cwd=self.fuseki_dir,
                                 env=env_opts)  # TODO: log
 
@@ -252,24 +402,12 @@ class Virtuoso(Triplestore):
         log_dir.mkdir(parents=True, exist_ok=True)
         db_dir.joinpath("database").mkdir(parents=True, exist_ok=True)
 
-        config_path = dataset.path.joinpath("virtuoso.ini")
-        from string import Template
-        template_path = self.installation_dir.parent.parent.parent.joinpath("virtuoso_template.ini")
-        config_template = Template(template_path.read_text("utf-8"))
-        substitutions = {
-            "installation_dir": str(self.installation_dir.absolute()),
-            "database_dir": str(db_dir.absolute()),
-            "benchmarks_dir": str(dataset.path.absolute()),
-            "thread_count": os.cpu_count(),
-            "max_dirty_buffers": ram_limit_g * 62500,
-            "number_of_buffers": ram_limit_g * 85000,
-            "serve_log": str(log_dir.joinpath("serve.log")),  # should be fine
-        }
-        config_path.write_text(config_template.substitute(substitutions), "utf-8")
+        config_path = self._write_config(dataset, log_dir)
 
         p = subprocess.Popen(
-            [f"{self.installation_dir.joinpath('bin').joinpath('virtuoso-t')}", "-c", f"{config_path}", "-w",
-             "+foreground"])
+            self.envelope.command([f"{self.installation_dir.joinpath('bin').joinpath('virtuoso-t')}",
+                                   "-c", f"{config_path}", "-w", "+foreground"]),
+            env=self.envelope.environment())
         util.wait_until_available(self.sparql_endpoint)
 
         command = \
@@ -283,9 +421,19 @@ shutdown;"""
 
         p2 = subprocess.Popen([f"{self.installation_dir.joinpath('bin').joinpath('isql')}"], text=True,
                               stdin=subprocess.PIPE)
-        p2.communicate(input=command)
-        mem = util.monitor_memory_usage(p)
-        p2.wait()
+        # don't wait for isql here, the loader runs while it executes the commands and is monitored meanwhile
+        p2.stdin.write(command)
+        p2.stdin.close()
+        try:
+            # the server is shut down by isql, its exit status doesn't tell whether the load succeeded
+            mem = self._monitor_load(p, dataset, db_version, check=False)
+        except LoadAbortedError:
+            p2.terminate()
+            p2.wait()
+            raise
+        if p2.wait() != 0 or p.returncode < 0:
+            raise LoadFailedError(f"Loading {dataset.name} into {self.name} failed, isql exited with status "
+                                  f"{p2.returncode} and the server with {p.returncode}.")
 
         #wait = p.wait(20 * 60)  # max 20 min
         #if wait != 0:
@@ -294,20 +442,66 @@ shutdown;"""
 
         return db_version, mem
 
+    def tune(self, dataset: Dataset) -> dict:
+        page = 8 * 1024
+        # Virtuoso recommends 2/3 of the free memory for buffers of 8 KiB pages, but buffers beyond the size of the
+        # database (about 100 bytes per triple including all indexes) are never used
+        by_memory = int(self.envelope.usable_memory_g * 1024 ** 3 * 2 / 3 / page)
+        by_dataset = int(dataset.triple_count() * 100 * 1.5 / page)
+        # at least Virtuoso's default for 2 GB of memory, unless the memory limit doesn't allow that
+        number_of_buffers = min(by_memory, max(170000, by_dataset))
+        return {
+            "number_of_buffers": number_of_buffers,
+            "max_dirty_buffers": number_of_buffers * 3 // 4,
+            "thread_count": self.envelope.thread_count,
+        }
+
+    def _write_config(self, dataset: Dataset, log_dir: Path) -> Path:
+        """Instantiate `virtuoso.ini` for the dataset, sized to the resource envelope."""
+        config_path = dataset.path.joinpath("virtuoso.ini")
+        from string import Template
+        template_path = self.installation_dir.parent.parent.parent.joinpath("virtuoso_template.ini")
+        config_template = Template(template_path.read_text("utf-8"))
+        substitutions = {
+            "installation_dir": str(self.installation_dir.absolute()),
+            "database_dir": str(self.dataset_db_dir(dataset).absolute()),
+            "benchmarks_dir": str(dataset.path.absolute()),
+            "thread_count": self.tuning.get("thread_count", self.envelope.thread_count),
+            "max_dirty_buffers": self.tuning.get("max_dirty_buffers", self.envelope.memory_g * 62500),
+            "number_of_buffers": self.tuning.get("number_of_buffers", self.envelope.memory_g * 85000),
+            "serve_log": str(log_dir.joinpath("serve.log")),  # should be fine
+        }
+        config_path.write_text(config_template.substitute(substitutions), "utf-8")
+        return config_path
+
     def start(self, db_version: DatabaseVersion) -> Popen[bytes]:
-        config_path = db_version.dataset.path.joinpath("virtuoso.ini")
-        assert config_path.is_file()
-        return subprocess.Popen([f"{self.installation_dir.joinpath('bin').joinpath('virtuoso-t')}",
-                                 "-c", f"{config_path}",
-                                 "-f",
-                                 "+foreground"])
+        log_dir = self.database_logs_dir(db_version)
+        log_dir.mkdir(parents=True, exist_ok=True)
+        # rewrite the configuration, the resource envelope might have changed since loading
+        config_path = self._write_config(db_version.dataset, log_dir)
+        executable = self.installation_dir.joinpath('bin').joinpath('virtuoso-t')
+        return subprocess.Popen(self.envelope.command([f"{executable}", "-c", f"{config_path}", "-f", "+foreground"]),
+                                env=self.envelope.environment())
 
 
 class ITR(Triplestore):
+    DEFAULT_FLAGS = ["--max-rank", "128", "--factor", "64", "--sampling", "0", "--rrr"]
+
     def __init__(self, *args, **kwargs):
         super().__init__("itr", *args, **kwargs)
         self.sparql_endpoint: str = "http://localhost:8080/"
 
+    def tune(self, dataset: Dataset) -> dict:
+        # the compression flags define the benchmarked ITR variant, so they are recorded but not tuned; only the
+        # OpenMP parallelism of the suffix sorting is adjusted to the available cores
+        return {"flags": ITR.DEFAULT_FLAGS, "omp_threads": self.envelope.thread_count}
+
+    def _environment(self) -> dict[str, str]:
+        env = self.envelope.environment()
+        if "omp_threads" in self.tuning:
+            env["OMP_NUM_THREADS"] = str(self.tuning["omp_threads"])
+        return env
+
     def download(self) -> None:
         # download ITR
         logging.info(f"Database dir: {self.database_dir}")
@@ -343,20 +537,14 @@ class ITR(Triplestore):
         db_dir.parent.mkdir(parents=True, exist_ok=True)  # intentionally throw if exists file, intentionally not throw error if parent exists
 
         db_version = DatabaseVersion.for_dataset(dataset)
-        logging.info(f"{self.installation_dir.absolute()}/build/cgraph-cli --max-rank 128 "
-                     "--factor 64 "
-                     "--sampling 0 "
-                     "--rrr "
+        flags = self.tuning.get("flags", ITR.DEFAULT_FLAGS)
+        logging.info(f"{self.installation_dir.absolute()}/build/cgraph-cli {' '.join(flags)} "
                      f"{dataset.dataset_path} {db_dir}")
-        proc = subprocess.Popen([f"{self.installation_dir.absolute()}/build/cgraph-cli",
-                                 "--max-rank", "128",
-                                 "--factor", "64",
-                                 "--sampling", "0",
-                                 "--rrr",
-                                 f"{dataset.dataset_path}", db_dir,
-                                 ])
-        mem = util.monitor_memory_usage(proc)
-        proc.wait()
+        proc = subprocess.Popen(self.envelope.command([f"{self.installation_dir.absolute()}/build/cgraph-cli",
+                                                       *flags,
+                                                       f"{dataset.dataset_path}", db_dir,
+                                                       ]), env=self._environment())
+        mem = self._monitor_load(proc, dataset, db_version)
         return db_version, mem
 
     def start(self, db_version: DatabaseVersion) -> Popen[bytes]:
@@ -370,6 +558,7 @@ class ITR(Triplestore):
                                  f"{self.dataset_db_dir(db_version.dataset)} "
                                  "-v "
                                  "--port 8080")
-        return subprocess.Popen([f"{self.installation_dir.absolute()}/build/cgraph-cli",
-                                 self.dataset_db_dir(db_version.dataset), "-v",
-                                 "--port", "8080"])
+        return subprocess.Popen(self.envelope.command([f"{self.installation_dir.absolute()}/build/cgraph-cli",
+                                                       self.dataset_db_dir(db_version.dataset), "-v",
+                                                       "--port", "8080"]),
+                                env=self._environment())
@@ -10,7 +10,10 @@ from rich.progress import Progress, DownloadColumn, SpinnerColumn, TransferSpeed
 
 import subprocess
 
+import tracing
 
+
+@tracing.traced("download")
 def download_file(url: str, dest: Path, checksum: int = None, checksum_type: str = "sha1"):
     dest.parent.mkdir(parents=True, exist_ok=True)
 
@@ -26,6 +29,7 @@ def download_file(url: str, dest: Path, checksum: int = None, checksum_type: str
             hasher = hashlib.sha512()
 
     total_length = int(response.headers.get("content-length"))
+    tracing.set_attributes(url=url, bytes=total_length)
     with Progress(SpinnerColumn(), *Progress.get_default_columns(), DownloadColumn(), TransferSpeedColumn(), transient=True) as progress:
         task = progress.add_task("Downloading", total=total_length)
         with open(dest, "wb") as file:
@@ -74,6 +78,7 @@ class CompressionAlgorithm(Enum):
     BZIP2 = 3
 
 
+@tracing.traced("decompress")
 def extract_file(source: Path, dest: Path, algorithm: CompressionAlgorithm, keep_source=True, overwrite=False) -> None:
     if not source.is_file():
         raise FileNotFoundError
@@ -101,6 +106,7 @@ def extract_file(source: Path, dest: Path, algorithm: CompressionAlgorithm, keep
         with open(dest, "wb") as f:
             subprocess.run(["pbzip2", "-dvc", source], stdout=f)
 
+    tracing.set_attributes(algorithm=algorithm.name, compressed_bytes=source.stat().st_size)
     if not keep_source:
         source.unlink(missing_ok=True)
 
@@ -143,4 +149,30 @@ def monitor_memory_usage(proc: subprocess.Popen, interval_seconds: int = 1) -> i
         memory = process.memory_info().rss
         highest_memory = max(highest_memory, memory)
         time.sleep(interval_seconds)
-    return highest_memory
\ No newline at end of file
+    return highest_memory
+
+
+class HyperLogLog:
+    """Cardinality estimator with a fixed memory footprint of 2^precision registers."""
+
+    def __init__(self, precision: int = 14) -> None:
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(self.m)
+
+    def add(self, item: bytes) -> None:
+        x = int.from_bytes(hashlib.blake2b(item, digest_size=8).digest(), "little")
+        index = x & (self.m - 1)
+        rest = x >> self.precision
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def estimate(self) -> int:
+        import math
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        raw = alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * self.m and zeros:
+            return round(self.m * math.log(self.m / zeros))  # linear counting for small cardinalities
+        return round(raw)